@@ -1,13 +1,25 @@
+from kdp_startup import StartupTimer, startup_report_option
+startup = StartupTimer()  # Started before the heavier imports below
 import os
+import sys
+import threading
 import configparser
 from tkinter import filedialog, StringVar, DoubleVar, messagebox, Listbox
 import customtkinter as ctk
-from docx import Document
-from docx.oxml import OxmlElement
-from docx.shared import Inches
-from PIL import Image
-from reportlab.pdfgen import canvas
-from threading import Thread
+from multiprocessing import freeze_support
+from kdp_cache import RenderCache, default_cache_dir
+from kdp_color import COLOR_MODES
+from kdp_index import folder_index, forget_folder
+from kdp_jobs import DONE, FAILED, JobQueue
+from kdp_preflight import describe
+from kdp_project import (ProjectWriter, legacy_project, load_project,
+                         restore_sequence)
+from kdp_render import (BookSettings, COMMON_SIZES, PROOF_PPI, proof_settings,
+                        sort_image_files, trim_size)
+from kdp_sequence import PageSequence
+from kdp_thumbs import ThumbnailCache
+from kdp_watch import FolderWatcher
+startup.mark('imports')
 
 # Initialize config file
 config_file = 'settings.ini'
@@ -27,13 +39,19 @@ else:
         'bottom_margin': '0',
         'left_margin': '0',
         'right_margin': '0',
-        'gutter': '0',
-        'image_sequence': '',
-        'deleted_items': ''
+        'gutter': '0'
     }
     with open(config_file, 'w') as configfile:
         config.write(configfile)
 
+# Thumbnails decoded ahead on either side of the selected page
+PREFETCH_RADIUS = 5
+
+PAGE_LIST_LABEL = "Page Serial(Click to select):"
+
+# Labels of the colour menu, in the order of kdp_color.COLOR_MODES
+COLOR_CHOICES = ["Keep Colour", "Grayscale", "CMYK"]
+
 # Initialize CustomTkinter
 ctk.set_appearance_mode("System")
 ctk.set_default_color_theme("blue")
@@ -80,15 +98,8 @@ class DraggableListbox(Listbox):
         if min(selected_indices) <= current_index <= max(selected_indices):
             return
 
-        # Get all items to move
-        items_to_move = [self.get(i) for i in selected_indices]
-        
-        # Remove items from their current positions
-        for index in sorted(selected_indices, reverse=True):
-            self.delete(index)
-        
         # Calculate new insertion position
-        num_items = len(items_to_move)
+        num_items = len(selected_indices)
         
         if current_index > max(selected_indices):
             # Moving down - adjust for items we removed
@@ -97,21 +108,16 @@ class DraggableListbox(Listbox):
             # Moving up
             insert_index = current_index
         
-        # Insert items at new position
-        new_indices = []
-        for i, item in enumerate(items_to_move):
-            pos = insert_index + i
-            self.insert(pos, item)
-            new_indices.append(pos)
+        # Move the pages in the app's sequence, which updates only the
+        # affected rows of this listbox
+        self.master.move_pages(selected_indices, insert_index)
+        new_indices = list(range(insert_index, insert_index + num_items))
         
         # Update selection to new positions
         self.selection_clear(0, 'end')
         for idx in new_indices:
             self.selection_set(idx)
         
-        # Update the image files in the main app
-        self.master.update_image_files()
-        
         # Update start index for continuous dragging
         self.start_index = current_index
         # Update the stored selection for the next drag operation
@@ -120,7 +126,7 @@ class DraggableListbox(Listbox):
 
 
 class ImageDocxApp(ctk.CTk):
-    def __init__(self):
+    def __init__(self, report_startup=False, startup_report_path=None):
         super().__init__()
 
         # Set window properties
@@ -199,26 +205,8 @@ class ImageDocxApp(ctk.CTk):
             self, text="KDP Size Template:")
         book_size_label.grid(row=4, column=2, padx=10, pady=2)
 
-        # Common KDP sizes
         self.book_size = StringVar(value='8.5 x 11 in')
-        self.common_sizes = [
-            "5 x 8 in",
-            "5.25 x 8 in",
-            "5.5 x 8.5 in",
-            "6 x 9 in",
-            "5.06 x 7.81 in",
-            "6.14 x 9.21 in",
-            "6.69 x 9.61 in",
-            "7 x 10 in",
-            "7.44 x 9.69 in",
-            "7.5 x 9.25 in",
-            "8 x 10 in",
-            "8.5 x 11 in",
-            "8.27 x 11.69 in",
-            "8.25 x 6 in",
-            "8.25 x 8.25 in",
-            "8.5 x 8.5 in"
-        ]
+        self.common_sizes = list(COMMON_SIZES)
         self.book_size_option = ctk.CTkOptionMenu(
             self, values=self.common_sizes, variable=self.book_size, command=self.update_size_on_change)
         self.book_size_option.grid(row=5, column=2, padx=10, pady=2)
@@ -279,13 +267,59 @@ class ImageDocxApp(ctk.CTk):
 
         # Create document button
         self.create_doc_btn = ctk.CTkButton(
-            self, text="Create Document", command=self.document_creator_thread, width=200, fg_color="#4a7a25")
+            self, text="Create Document", command=self.queue_document, width=200, fg_color="#4a7a25")
         self.create_doc_btn.grid(row=13, column=1, pady=20)
 
-        self.image_files = []
+        # Build progress, fed from the build thread through after()
+        self.progress_bar = ctk.CTkProgressBar(self, width=300)
+        self.progress_bar.set(0)
+        self.progress_bar.grid(row=14, column=0, columnspan=2, padx=10, pady=(0, 10))
+        self.progress_label = ctk.CTkLabel(self, text="")
+        self.progress_label.grid(row=14, column=2, padx=10, pady=(0, 10))
+
+        self.sequence = PageSequence()
+        # Resampled pages are reused across builds while tweaking the book
+        self.render_cache = RenderCache()
+        # Books queued with Create Document, built one after another, each
+        # from the settings it was queued with
+        self.job_queue = JobQueue(cache=self.render_cache,
+                                  on_status=self.on_job_status,
+                                  on_progress=self.on_build_progress)
+        self.job_rows = []  # Job ids in job list order
+        self.job_listbox = Listbox(
+            self, height=4, exportselection=False, font=("Arial", 11),
+            background="#343638", foreground="#ffffff",
+            selectbackground="#1f6aa5", selectforeground="#ffffff")
+        self.job_listbox.grid(row=15, column=0, columnspan=2, padx=10,
+                              pady=(0, 10), sticky="ew")
+        self.cancel_job_btn = ctk.CTkButton(
+            self, text="Cancel Job", command=self.cancel_job, fg_color="#c73126")
+        self.cancel_job_btn.grid(row=15, column=2, padx=5, pady=(0, 10))
+        self.retry_job_btn = ctk.CTkButton(
+            self, text="Retry Job", command=self.retry_job)
+        self.retry_job_btn.grid(row=15, column=4, padx=5, pady=(0, 10))
+
+        # Quick low resolution proof for checking order and margins; the
+        # full resolution build stays behind Create Document
+        self.proof_ppi = StringVar(value=str(PROOF_PPI))
+        self.proof_ppi_option = ctk.CTkOptionMenu(
+            self, values=["72", "96", "100", "150"], variable=self.proof_ppi)
+        self.proof_ppi_option.grid(row=16, column=0, padx=10, pady=(0, 10))
+        self.create_proof_btn = ctk.CTkButton(
+            self, text="Create Proof", command=self.queue_proof, width=200)
+        self.create_proof_btn.grid(row=16, column=1, pady=(0, 10))
+
+        # Interior colour; grayscale and CMYK are converted after resampling.
+        # CMYK is only offered once output_profile is set in settings.ini.
+        self.color_mode = StringVar(value=COLOR_CHOICES[0])
+        color_choices = COLOR_CHOICES if config['Settings'].get('output_profile') \
+            else COLOR_CHOICES[:2]
+        self.color_option = ctk.CTkOptionMenu(
+            self, values=color_choices, variable=self.color_mode)
+        self.color_option.grid(row=16, column=2, padx=5, pady=(0, 10))
 
         self.image_listbox_label = ctk.CTkLabel(
-            self, text="Page Serial(Click to select):")
+            self, text=PAGE_LIST_LABEL)
         self.image_listbox_label.grid(row=6, column=2, pady=10)
 
         self.add_custom_image_btn = ctk.CTkButton(
@@ -305,6 +339,7 @@ class ImageDocxApp(ctk.CTk):
         self.scrollbar.grid(row=8, column=3, rowspan=4,
                             pady=10, sticky="ns")
         self.image_listbox.bind("<<ListboxSelect>>", self.update_preview)
+        self.sequence.subscribe(self.on_sequence_change)
 
         self.deleted_items = []  # To store deleted items
 
@@ -335,62 +370,42 @@ class ImageDocxApp(ctk.CTk):
         self.preview_canvas = ctk.CTkLabel(
             self, text="", width=200)
         self.preview_canvas.grid(row=6, column=4, rowspan=5, padx=10, pady=10)
+        self.preview_path = None
+        self.thumbnails = ThumbnailCache(
+            self.on_thumbnail_ready, directory=default_cache_dir('thumbnails'))
+        # Page order is saved per folder, debounced and off the Tk thread
+        self.project_writer = ProjectWriter()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        # Pages dropped into the folder while the app is open are appended
+        self.folder_watcher = None
+        self.watch_folder = ctk.BooleanVar(value=True)
+        self.watch_folder_checkbox = ctk.CTkCheckBox(
+            self, text="Watch folder for new pages", variable=self.watch_folder,
+            command=self.restart_watcher)
+        self.watch_folder_checkbox.grid(row=14, column=4, padx=10, pady=(0, 10))
+        # The last folder is only read once the window is on screen
+        self.loading_folder = None
+        self.report_startup = report_startup
+        self.startup_report_path = startup_report_path
+        self.exit_status = 0
+        startup.mark('window')
+        self.after_idle(self.on_first_paint)
+
+    def on_first_paint(self):
+        self.update_idletasks()  # Let the pending redraws finish first
+        startup.mark('paint')
         folder_path = self.input_folder.get()
         if os.path.exists(folder_path):
-            self.image_files = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(
-                ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))])
-            try:
-                self.image_files = sorted(self.image_files, key=lambda x: float(
-                    x.split(' ')[-1].split('.')[0].replace('-', '.')))
-            except:
-                pass
-
-        # Load image sequence from config if it exists
-        self.image_files = []
-        if 'image_sequence' in config['Settings'] and config['Settings']['image_sequence']:
-            saved_sequence = config['Settings']['image_sequence'].split('|')
-            folder_path = self.input_folder.get()
-            if os.path.exists(folder_path):
-                # Filter only files that exist in the folder
-                existing_files = [f for f in os.listdir(folder_path) if f.lower().endswith(
-                    ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))]
-                
-                # Load deleted items FIRST
-                self.deleted_items = []  # To store deleted items
-                if 'deleted_items' in config['Settings'] and config['Settings']['deleted_items']:
-                    deleted_data = config['Settings']['deleted_items'].split('|')
-                    for item_data in deleted_data:
-                        if item_data:
-                            try:
-                                filename, index_str = item_data.split(':', 1)
-                                index = int(index_str)
-                                self.deleted_items.append((filename, index))
-                            except:
-                                pass
-                
-                # Get list of deleted filenames for filtering
-                deleted_filenames = [filename for filename, index in self.deleted_items]
-                
-                # Filter saved sequence to exclude deleted items
-                self.image_files = [f for f in saved_sequence if f in existing_files and f not in deleted_filenames]
-                
-                # Add any new files that weren't in the saved sequence and aren't deleted
-                new_files = [f for f in existing_files if f not in self.image_files and f not in deleted_filenames]
-                self.image_files.extend(new_files)
+            self.load_sequence(folder_path)
         else:
-            # Fallback to original loading method
-            folder_path = self.input_folder.get()
-            if os.path.exists(folder_path):
-                self.image_files = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(
-                    ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))])
-                try:
-                    self.image_files = sorted(self.image_files, key=lambda x: float(
-                        x.split(' ')[-1].split('.')[0].replace('-', '.')))
-                except:
-                    pass
+            self.finish_startup()
 
-        # Load images from folder
-        self.update_image_list()
+    def finish_startup(self):
+        startup.mark('folder')
+        if self.report_startup:
+            startup.write(self.startup_report_path)
+            self.exit_status = 0 if startup.within_target() else 1
+            self.on_close()
 
     def add_custom_image(self):
         file_paths = filedialog.askopenfilenames(
@@ -419,13 +434,12 @@ class ImageDocxApp(ctk.CTk):
                 import shutil
                 shutil.copy2(file_path, dest_path)
                 
-                # Insert into listbox and image_files
-                self.image_listbox.insert(insert_index, filename)
-                self.image_files.insert(insert_index, filename)
+                # Insert into the sequence, which also adds the listbox row
+                self.sequence.insert(insert_index, [filename])
                 insert_index += 1
             
-            self.update_image_list()
-            self.save_config()  # Save immediately after adding images
+            forget_folder(self.input_folder.get())
+            self.save_sequence()
             
             # Select the first added image
             if selection:
@@ -436,40 +450,116 @@ class ImageDocxApp(ctk.CTk):
     def duplicate_item(self):
         selected_indices = self.image_listbox.curselection()
         if selected_indices:
-            # Sort in normal order to duplicate in sequence
-            for selected_index in sorted(selected_indices):
-                selected_item = self.image_listbox.get(selected_index)
-                # Insert duplicate right after the original
-                self.image_listbox.insert(selected_index + 1, selected_item)
-            self.update_image_files()  # This now calls save_config automatically
+            # Insert each duplicate right after the original
+            self.sequence.duplicate(selected_indices)
+            self.save_sequence()
 
-    def update_image_files(self):
-        self.image_files = list(self.image_listbox.get(0, self.image_listbox.size()))
-        self.save_config()  # Save immediately after sequence change
+    def move_pages(self, indices, target):
+        self.sequence.move(indices, target)
+        self.save_sequence()
 
     def delete_item(self):
         selected_indices = self.image_listbox.curselection()
         if selected_indices:
-            # Sort in reverse order to delete from bottom to top
-            for selected_index in sorted(selected_indices, reverse=True):
-                selected_item = self.image_listbox.get(selected_index)
-                self.deleted_items.append((selected_item, selected_index))
-                self.image_listbox.delete(selected_index)
-            self.update_image_files()  # This now calls save_config automatically
-            self.save_deleted_items()  # Save deleted items immediately
+            # Rows are removed from the bottom up so undo can restore them
+            self.deleted_items.extend(self.sequence.delete(selected_indices))
+            self.save_sequence()  # This also saves the deleted items
 
     def undo_delete(self):
         if self.deleted_items:
             last_deleted_item, index = self.deleted_items.pop()
-            self.image_listbox.insert(index, last_deleted_item)
-            self.update_image_files()  # This now calls save_config automatically
-            self.save_deleted_items()  # Save deleted items immediately
-
-    def save_deleted_items(self):
-        # Convert deleted_items to string format: "filename:index|filename:index"
-        deleted_str = '|'.join([f"{filename}:{index}" for filename, index in self.deleted_items])
-        config['Settings']['deleted_items'] = deleted_str
-        self.save_config()
+            self.sequence.insert(index, [last_deleted_item])
+            self.save_sequence()  # This also saves the deleted items
+
+    def save_sequence(self):
+        folder_path = self.input_folder.get()
+        # While a folder loads the list still holds the previous folder's pages
+        if os.path.isdir(folder_path) and self.loading_folder is None:
+            self.project_writer.schedule(
+                folder_path, self.image_files, self.deleted_items)
+
+    def load_sequence(self, folder_path):
+        # The folder is listed on a thread so a big folder or a slow share
+        # never holds up the window; the page list fills in when it is done
+        self.loading_folder = folder_path
+        self.image_listbox_label.configure(text="Loading pages...")
+        threading.Thread(target=self.read_sequence, args=(folder_path,),
+                         daemon=True).start()
+
+    def read_sequence(self, folder_path):
+        # Runs on the loader thread
+        try:
+            index = folder_index(folder_path)
+        except OSError:
+            index = None  # Gone since it was picked
+        project = load_project(folder_path)
+        self.after(0, self.apply_sequence, folder_path, index, project)
+
+    def apply_sequence(self, folder_path, index, project):
+        if folder_path != self.loading_folder:
+            return  # Another folder was picked in the meantime
+        self.loading_folder = None
+        self.image_listbox_label.configure(text=PAGE_LIST_LABEL)
+        existing_files = index.names if index is not None else []
+        if project is None and config['Settings'].get('image_sequence'):
+            # Move the sequence older versions kept in settings.ini over to
+            # the folder's project file
+            project = legacy_project(config['Settings'])
+            config.remove_option('Settings', 'image_sequence')
+            config.remove_option('Settings', 'deleted_items')
+            self.image_files = restore_sequence(*project, existing_files)
+            self.deleted_items = project[1]
+            self.save_sequence()
+        elif project is None:
+            self.image_files = existing_files
+            self.deleted_items = []
+        else:
+            self.image_files = restore_sequence(*project, existing_files)
+            self.deleted_items = project[1]
+        # The watcher starts from this listing instead of scanning again
+        self.restart_watcher(index.entries if index is not None else None)
+        self.finish_startup()
+
+    def restart_watcher(self, known=None):
+        if self.loading_folder is not None:
+            return  # Started once the folder has loaded
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+            self.folder_watcher = None
+        folder_path = self.input_folder.get()
+        if self.watch_folder.get() and os.path.isdir(folder_path):
+            watcher = FolderWatcher(
+                folder_path, lambda *change: self.after(0, self.apply_folder_change, watcher, *change))
+            self.folder_watcher = watcher.start(known)
+
+    def apply_folder_change(self, watcher, added, modified, removed):
+        # Runs on the Tk thread. Changes from a watcher that has since been
+        # replaced belong to another folder.
+        if watcher is not self.folder_watcher:
+            return
+        folder_path = watcher.folder_path
+        forget_folder(folder_path)
+        for filename in modified:
+            # The render cache keys pages on mtime, so only previews go stale
+            path = os.path.join(folder_path, filename)
+            self.thumbnails.invalidate(path)
+            if path == self.preview_path:
+                self.update_preview()
+        present = set(self.image_files)
+        deleted_filenames = {filename for filename, index in self.deleted_items}
+        new_files = [f for f in sort_image_files(added)
+                     if f not in present and f not in deleted_filenames]
+        if new_files:
+            self.sequence.insert(len(self.sequence), new_files)
+            self.save_sequence()
+
+    def on_close(self):
+        for job in self.job_queue.jobs():
+            self.job_queue.cancel(job.id)
+        if self.folder_watcher is not None:
+            self.folder_watcher.stop()
+        self.project_writer.flush()
+        self.destroy()
 
     def update_selection_view(self):
         # Get the index of the selected item
@@ -485,52 +575,66 @@ class ImageDocxApp(ctk.CTk):
             self.input_folder.set(folder_selected)
             folder_path = self.input_folder.get()
             
-            # Clear deleted items when changing folders
-            self.deleted_items = []
-            self.save_deleted_items()
-            
             if os.path.exists(folder_path):
-                # Try to load saved sequence first
-                if 'image_sequence' in config['Settings'] and config['Settings']['image_sequence']:
-                    saved_sequence = config['Settings']['image_sequence'].split('|')
-                    existing_files = [f for f in os.listdir(folder_path) if f.lower().endswith(
-                        ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))]
-                    self.image_files = [f for f in saved_sequence if f in existing_files]
-                    
-                    # Add any new files that weren't in the saved sequence
-                    new_files = [f for f in existing_files if f not in self.image_files]
-                    self.image_files.extend(new_files)
-                else:
-                    # Fallback to original loading
-                    self.image_files = sorted([f for f in os.listdir(folder_path) if f.lower().endswith(
-                        ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff'))])
-                    try:
-                        self.image_files = sorted(self.image_files, key=lambda x: float(
-                            x.split(' ')[-1].split('.')[0].replace('-', '.')))
-                    except:
-                        pass
-                self.save_config()  # Save the updated sequence
-            self.update_image_list()
-
-    def update_image_list(self):
-        folder_path = self.input_folder.get()
-        if not os.path.exists(folder_path):
-            return
-
-        self.image_listbox.delete(0, "end")
-        for img in self.image_files:
-            self.image_listbox.insert("end", img)
+                # Each folder remembers its own order and deleted pages
+                self.project_writer.flush()
+                self.load_sequence(folder_path)
+                self.save_config()
+
+    @property
+    def image_files(self):
+        # The live page list, edited only through self.sequence
+        return self.sequence.items
+
+    @image_files.setter
+    def image_files(self, image_files):
+        self.sequence.reset(image_files)
+
+    def on_sequence_change(self, op, *args):
+        # Mirror each sequence edit onto just the listbox rows it touched
+        if op == 'reset':
+            self.image_listbox.delete(0, "end")
+            self.image_listbox.insert("end", *args[0])
+        elif op == 'insert':
+            index, items = args
+            self.image_listbox.insert(index, *items)
+        elif op == 'delete':
+            self.image_listbox.delete(args[0])
+        elif op == 'replace':
+            index, item = args
+            self.image_listbox.delete(index)
+            self.image_listbox.insert(index, item)
 
     def update_preview(self, event=None):
         selection = self.image_listbox.curselection()
         if selection:
-            img_path = os.path.join(
-                self.input_folder.get(), self.image_files[selection[0]])
-            image = Image.open(img_path)
-            image.thumbnail((200, 200))
-            self.preview_img = ctk.CTkImage(
-                light_image=image, dark_image=image, size=(200, 200))
-            self.preview_canvas.configure(image=self.preview_img)
+            index = selection[0]
+            folder_path = self.input_folder.get()
+            self.preview_path = os.path.join(folder_path, self.image_files[index])
+            image = self.thumbnails.get(self.preview_path)
+            if image is not None:
+                self.show_preview(image)
+
+            # Decode the selected page first, then warm up its neighbours
+            neighbours = []
+            for offset in range(1, PREFETCH_RADIUS + 1):
+                for i in (index + offset, index - offset):
+                    if 0 <= i < len(self.image_files):
+                        neighbours.append(os.path.join(folder_path, self.image_files[i]))
+            self.thumbnails.request([self.preview_path] + neighbours)
+
+    def on_thumbnail_ready(self, path, image):
+        # Called on the thumbnail thread
+        self.after(0, self.show_thumbnail, path, image)
+
+    def show_thumbnail(self, path, image):
+        if path == self.preview_path:
+            self.show_preview(image)
+
+    def show_preview(self, image):
+        self.preview_img = ctk.CTkImage(
+            light_image=image, dark_image=image, size=(200, 200))
+        self.preview_canvas.configure(image=self.preview_img)
 
     def move_up(self):
         selected_indices = self.image_listbox.curselection()
@@ -538,15 +642,14 @@ class ImageDocxApp(ctk.CTk):
             # Move all selected items up
             for index in sorted(selected_indices):
                 if index > 0:
-                    self.image_files[index], self.image_files[index-1] = self.image_files[index-1], self.image_files[index]
+                    self.sequence.swap(index, index - 1)
             
-            self.update_image_list()
             # Reselect the moved items (they all moved up by 1)
             self.image_listbox.selection_clear(0, 'end')
             for new_index in [i-1 for i in selected_indices]:
                 self.image_listbox.selection_set(new_index)
             self.update_selection_view()
-            self.save_config()  # Save immediately after move
+            self.save_sequence()
 
     def move_down(self):
         selected_indices = self.image_listbox.curselection()
@@ -554,33 +657,24 @@ class ImageDocxApp(ctk.CTk):
             # Move all selected items down (from bottom to top)
             for index in sorted(selected_indices, reverse=True):
                 if index < len(self.image_files) - 1:
-                    self.image_files[index], self.image_files[index+1] = self.image_files[index+1], self.image_files[index]
+                    self.sequence.swap(index, index + 1)
             
-            self.update_image_list()
             # Reselect the moved items (they all moved down by 1)
             self.image_listbox.selection_clear(0, 'end')
             for new_index in [i+1 for i in selected_indices]:
                 self.image_listbox.selection_set(new_index)
             self.update_selection_view()
-            self.save_config()  # Save immediately after move
+            self.save_sequence()
 
     def update_listbox_selection(self, new_index):
-        self.update_image_list()
         self.image_listbox.select_set(new_index)
         self.image_listbox.activate(new_index)
         self.update_preview()
 
     def update_size_on_change(self, item):
-        if self.bleed_mode.get() == "Bleed":
-            width, height = item.split(" x ")
-            height = height.replace(" in", "")
-            self.page_width.set(float(width)+0.125)
-            self.page_height.set(float(height)+0.25)
-        else:
-            width, height = item.split(" x ")
-            height = height.replace(" in", "")
-            self.page_width.set(float(width))
-            self.page_height.set(float(height))
+        width, height = trim_size(item, self.bleed_mode.get())
+        self.page_width.set(width)
+        self.page_height.set(height)
 
     def update_keep_docx_visibility(self, *args):
         if self.file_type.get() == "PDF":
@@ -600,142 +694,118 @@ class ImageDocxApp(ctk.CTk):
         config['Settings']['left_margin'] = str(self.left_margin.get())
         config['Settings']['right_margin'] = str(self.right_margin.get())
         config['Settings']['gutter'] = str(self.gutter.get())
-        
-        # Save the current image sequence
-        config['Settings']['image_sequence'] = '|'.join(self.image_files)
-        
-        # Note: deleted_items is saved separately via save_deleted_items()
+
+        # The page sequence lives in the folder's project file now
+        config.remove_option('Settings', 'image_sequence')
+        config.remove_option('Settings', 'deleted_items')
 
         with open(config_file, 'w') as configfile:
             config.write(configfile)
 
-    def document_creator_thread(self):
-        self.create_doc_btn.configure(state="disabled", text="Processing...")
-        thread = Thread(target=self.create_document)
-        thread.daemon = True
-        thread.start()
-
-    def create_document(self):
+    def on_build_progress(self, job, event):
+        # Runs on the build thread; Tk widgets may only be touched from the
+        # main loop, so hand the event over
+        self.after(0, self.show_build_progress, job.name, event)
+
+    def show_build_progress(self, name, event):
+        if event['event'] == 'start':
+            self.progress_bar.set(0)
+            self.progress_label.configure(text=f"{name}: 0 / {event['total']} pages")
+        elif event['event'] == 'page':
+            self.progress_bar.set(event['done'] / event['total'])
+            minutes, seconds = divmod(int(event['eta']), 60)
+            self.progress_label.configure(
+                text=f"{name}: {event['done']} / {event['total']} pages, "
+                     f"ETA {minutes}:{seconds:02d}")
+        elif event['event'] == 'finish':
+            self.progress_bar.set(1)
+            self.progress_label.configure(
+                text=f"{name}: {event['pages']} pages in {event['elapsed']:.0f}s")
+
+    def book_settings(self):
+        # A frozen snapshot of the settings on screen; the build never reads
+        # the Tk variables again
+        return BookSettings(
+            input_folder=self.input_folder.get(),
+            output_filename=self.output_filename.get(),
+            file_type=self.file_type.get(),
+            page_width=self.page_width.get(),
+            page_height=self.page_height.get(),
+            top_margin=self.top_margin.get(),
+            bottom_margin=self.bottom_margin.get(),
+            left_margin=self.left_margin.get(),
+            right_margin=self.right_margin.get(),
+            gutter=self.gutter.get(),
+            bleed_mode=self.bleed_mode.get(),
+            keep_docx=self.keep_docx.get(),
+            output_folder="" if self.save_in_same_folder.get() else "OUTPUT",
+            color=COLOR_MODES[COLOR_CHOICES.index(self.color_mode.get())],
+            # Set output_profile in settings.ini for colour managed output
+            output_profile=config['Settings'].get('output_profile', ''),
+            # Rebuilding after a small edit only renders the edited pages
+            incremental=True)
+
+    def queue_document(self):
         self.save_config()  # Save config when creating the document
-        folder_path = self.input_folder.get()
-        if not os.path.exists(folder_path):
-            messagebox.showerror(
-                "Error", "Selected folder does not exist, please select input folder again.")
-            self.create_doc_btn.configure(
-                state="normal", text="Create Document")
-            return
-        output_name = self.output_filename.get()
-        file_type = self.file_type.get()
-
-        doc = Document()
-        section = doc.sections[0]
-        sectPr = section._sectPr
-
-        # Create the mirrorMargins element
-        mirror_margins = OxmlElement('w:mirrorMargins')
-        sectPr.append(mirror_margins)
-        section.page_width = Inches(self.page_width.get())
-        section.page_height = Inches(self.page_height.get())
-        section.top_margin = Inches(self.top_margin.get())
-        section.bottom_margin = Inches(self.bottom_margin.get())
-        section.left_margin = Inches(
-            self.left_margin.get())  # left is inside margin
-        section.right_margin = Inches(
-            self.right_margin.get())  # right is outside margin
-        section.gutter = Inches(self.gutter.get())
-
-        page_width, page_height = section.page_width, section.page_height
-
-        if self.bleed_mode.get() == "Bleed":
-            print("Bleed mode")
-            available_width = page_width
-            available_height = page_height
-            section.left_margin = Inches(0)
-            section.right_margin = Inches(0)
-            section.top_margin = Inches(0)
-            section.bottom_margin = Inches(0)
-            section.gutter = Inches(0)
+        settings = self.book_settings()
+        self.job_queue.submit(settings.output_filename, settings, list(self.image_files))
+
+    def queue_proof(self):
+        self.save_config()
+        settings = proof_settings(self.book_settings(), int(self.proof_ppi.get()))
+        self.job_queue.submit(settings.output_filename, settings, list(self.image_files))
+
+    def on_job_status(self, job):
+        # Runs on a runner thread
+        self.after(0, self.show_job, job.id, job.status)
+
+    def show_job(self, job_id, status):
+        job = self.job_queue.get(job_id)
+        text = f"{job.name}.{job.settings.file_type.lower()}: {status}"
+        if job_id in self.job_rows:
+            index = self.job_rows.index(job_id)
+            selected = index in self.job_listbox.curselection()
+            self.job_listbox.delete(index)
+            self.job_listbox.insert(index, text)
+            if selected:
+                self.job_listbox.select_set(index)
         else:
-            available_width = page_width - section.left_margin - \
-                section.right_margin - section.gutter
-            available_height = page_height - section.top_margin - \
-                section.bottom_margin - section.gutter
+            self.job_rows.append(job_id)
+            self.job_listbox.insert("end", text)
+            self.job_listbox.see("end")
 
-        # Check if there are no images to process
-        if not self.image_files:
+        if status == FAILED:
+            messagebox.showerror(job.error_title, f"{job.name}: {job.error}")
+        elif status == DONE and job.report.warnings:
             messagebox.showwarning(
-                "No Images Found", "No image files found in the selected folder.")
-            self.create_doc_btn.configure(
-                state="normal", text="Create Document")
-            return
-
-        # Flag to track if any valid images were added
-        any_images_added = False
+                "Low Resolution Pages",
+                f"{job.name} was saved, but these pages are below "
+                f"{job.settings.ppi} PPI:\n{describe(job.report.warnings)}")
+        elif status == DONE and not self.job_queue.pending():
+            messagebox.showinfo("Document Created Successfully!",
+                                f"Document saved as {job.settings.output_filename}."
+                                f"{job.settings.file_type.lower()}")
 
-        if self.save_in_same_folder.get():
-            target_folder = folder_path
-        else:
-            target_folder = "OUTPUT"
-        # Create PDF using reportlab
-        pdf_file_path = os.path.join(target_folder, f"{output_name}.pdf")
-        if os.path.exists(pdf_file_path):
-            os.remove(pdf_file_path)
-        pdf_canvas = canvas.Canvas(
-            pdf_file_path, pagesize=(page_width.pt, page_height.pt))
-
-        target_ppi = 330
-
-        for idx, filename in enumerate(self.image_files):
-            for _try in range(3):
-                try:
-                    file_path = os.path.join(folder_path, filename)
-                    image = Image.open(file_path)
-
-                    # Ensure image has content before proceeding
-                    if image.size[0] == 0 or image.size[1] == 0:
-                        continue  # Skip blank images
-
-                    resized_image = image.resize((int(page_width.pt * target_ppi / 72), int(
-                        page_height.pt * target_ppi / 72)), Image.LANCZOS)  # Resize for 300 PPI
-
-                    temp_image_path = os.path.join(
-                        folder_path, f'temp_{filename}')
-                    resized_image.save(temp_image_path, format='PNG')
-
-                    # Add image to the document
-                    doc.add_picture(temp_image_path, width=available_width,
-                                    height=available_height)
-                    break
-                except:
-                    pass
-
-            pdf_canvas.drawImage(temp_image_path, 0, 0, width=int(
-                page_width.pt), height=int(page_height.pt))
-            pdf_canvas.showPage()
-            any_images_added = True  # Mark that an image has been added
-            os.remove(temp_image_path)
-
-        # Save the document only if there are images added
-        if any_images_added:
-            if os.path.exists(os.path.join(target_folder, output_name + '.docx')):
-                os.remove(os.path.join(target_folder, output_name + '.docx'))
-            doc.save(os.path.join(target_folder, output_name + '.docx'))
-            
+    def selected_job(self):
+        selection = self.job_listbox.curselection()
+        return self.job_rows[selection[0]] if selection else None
 
-            if file_type == "PDF":
-                pdf_canvas.save()
-                if not self.keep_docx.get():
-                    os.remove(os.path.join(target_folder, output_name + '.docx'))
+    def cancel_job(self):
+        job_id = self.selected_job()
+        if job_id is not None:
+            self.job_queue.cancel(job_id)
 
-        messagebox.showinfo("Document Created Successfully!", f"Document saved as {
-                            output_name}.{file_type.lower()}")
-        self.create_doc_btn.configure(
-            state="normal", text="Create Document")
+    def retry_job(self):
+        job_id = self.selected_job()
+        if job_id is not None:
+            self.job_queue.retry(job_id)
 
 
 # Run the application
 if __name__ == "__main__":
+    freeze_support()  # Lets the frozen build spawn render workers
     if not os.path.exists("OUTPUT"):
         os.makedirs("OUTPUT")
-    app = ImageDocxApp()
+    app = ImageDocxApp(*startup_report_option(sys.argv))
     app.mainloop()
+    sys.exit(app.exit_status)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import freeze_support
+from PIL import Image, ImageDraw
+import PIL
+from kdp_render import BookSettings, COMMON_SIZES, build_book, trim_size
+from kdp_resample import BACKENDS, backend_available
+
+# Benchmarks for the build pipeline. Generates synthetic image folders from
+# a fixed seed, builds every folder headlessly at each KDP trim size in
+# Bleed and No Bleed mode, and writes the timings as JSON so runs on the
+# same machine can be compared over time.
+#
+#   python kdp_bench.py --suite quick --output bench.json
+#   python kdp_bench.py --suite full --output new.json --compare bench.json
+#   python kdp_bench.py --backends pillow numpy
+#
+# Builds run without the render cache, so every page is rendered each time.
+# Each case runs in a fresh process, so its peak memory figures are its own:
+# peak_rss is the process that assembles the book, worker_peak_rss the
+# largest of its render workers (decoding happens there; None on Windows).
+
+BLEED_MODES = ("Bleed", "No Bleed")
+
+# Folder recipes: page count, source pixel size, share of JPEG sources (the
+# rest are PNG) and share of pages that repeat an earlier image
+FOLDERS = {
+    'small-mixed': dict(count=12, pixel_size=(1275, 1650), jpeg_share=0.5,
+                        duplicate_share=0.0),
+    'photo-large': dict(count=24, pixel_size=(2800, 4200), jpeg_share=1.0,
+                        duplicate_share=0.0),
+    'lineart-dupes': dict(count=40, pixel_size=(2100, 3000), jpeg_share=0.0,
+                          duplicate_share=0.25),
+}
+
+SUITES = {
+    # One folder at a handful of sizes, for a quick check before committing
+    'quick': dict(folders=['small-mixed'],
+                  sizes=["5 x 8 in", "6 x 9 in", "8.5 x 11 in"]),
+    'full': dict(folders=list(FOLDERS), sizes=COMMON_SIZES),
+}
+
+
+def photo_page(rng, pixel_size):
+    # Soft noise over a gradient, which compresses like a scanned photo
+    base = Image.linear_gradient('L').resize(pixel_size).convert('RGB')
+    noise = Image.effect_noise(pixel_size, rng.uniform(20, 60)).convert('RGB')
+    tint = Image.new('RGB', pixel_size, tuple(rng.randrange(256) for _ in range(3)))
+    return Image.blend(Image.blend(base, tint, 0.5), noise, 0.35)
+
+
+def line_art_page(rng, pixel_size):
+    # Flat shapes with hard edges, like an illustration or comic page
+    image = Image.new('RGB', pixel_size, 'white')
+    draw = ImageDraw.Draw(image)
+    width, height = pixel_size
+    for _ in range(40):
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        x1, y1 = x0 + rng.randrange(width // 3), y0 + rng.randrange(height // 3)
+        colour = tuple(rng.randrange(256) for _ in range(3))
+        if rng.random() < 0.5:
+            draw.rectangle([x0, y0, x1, y1], fill=colour, outline='black', width=6)
+        else:
+            draw.ellipse([x0, y0, x1, y1], fill=colour, outline='black', width=6)
+    return image
+
+
+def make_folder(folder_path, count, pixel_size, jpeg_share, duplicate_share,
+                seed=0):
+    # Writes page 1 ... page N and returns the file names in page order
+    rng = random.Random(seed)
+    os.makedirs(folder_path, exist_ok=True)
+    image_files = []
+    for number in range(1, count + 1):
+        if image_files and rng.random() < duplicate_share:
+            # A repeated page is a copy of an earlier file under a new name
+            source = rng.choice(image_files)
+            filename = f"page {number}{os.path.splitext(source)[1]}"
+            shutil.copyfile(os.path.join(folder_path, source),
+                            os.path.join(folder_path, filename))
+        elif rng.random() < jpeg_share:
+            filename = f"page {number}.jpg"
+            photo_page(rng, pixel_size).save(
+                os.path.join(folder_path, filename), quality=88)
+        else:
+            filename = f"page {number}.png"
+            line_art_page(rng, pixel_size).save(os.path.join(folder_path, filename))
+        image_files.append(filename)
+    return image_files
+
+
+def run_case(folder_path, image_files, size, bleed_mode, output_folder,
+             file_type, workers, backend='pillow'):
+    page_width, page_height = trim_size(size, bleed_mode)
+    settings = BookSettings(
+        input_folder=folder_path,
+        output_filename='bench',
+        file_type=file_type,
+        page_width=page_width,
+        page_height=page_height,
+        bleed_mode=bleed_mode,
+        keep_docx=False,
+        output_folder=output_folder,
+        resample_backend=backend)
+    report = build_book(settings, image_files, workers=workers)
+    for path in report.outputs:
+        os.remove(path)
+    return {
+        'size': size,
+        'bleed_mode': bleed_mode,
+        'backend': backend,
+        'pages': report.pages,
+        'elapsed': round(report.elapsed, 3),
+        'pages_per_sec': round(report.pages / report.elapsed, 3) if report.elapsed else None,
+        'stage_times': {stage: round(seconds, 3)
+                        for stage, seconds in report.stage_times.items()},
+        'sink_times': {name: round(seconds, 3)
+                       for name, seconds in report.sink_times.items()},
+        'peak_rss': report.peak_rss,
+        'output_bytes': report.output_bytes,
+        'deduplicated': report.deduplicated,
+    }
+
+
+def worker_peak_rss():
+    # Largest peak resident memory of any finished child process, in bytes
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def isolated_case(*args):
+    # Runs in a fresh process; the build's worker pool is joined by the time
+    # run_case returns, so the workers count as finished children
+    result = run_case(*args)
+    result['worker_peak_rss'] = worker_peak_rss()
+    return result
+
+
+def run_suite(suite, file_type='PDF', workers=None, seed=0, log=None,
+              backends=('pillow',)):
+    work_dir = tempfile.mkdtemp(prefix='kdp-bench-')
+    results = []
+    context = multiprocessing.get_context('spawn')
+    try:
+        for name in suite['folders']:
+            recipe = FOLDERS[name]
+            folder_path = os.path.join(work_dir, name)
+            image_files = make_folder(folder_path, seed=seed, **recipe)
+            output_folder = os.path.join(work_dir, 'out')
+            for size in suite['sizes']:
+                for bleed_mode in BLEED_MODES:
+                    for backend in backends:
+                        with ProcessPoolExecutor(max_workers=1,
+                                                 mp_context=context) as case:
+                            result = case.submit(
+                                isolated_case, folder_path, image_files, size,
+                                bleed_mode, output_folder, file_type, workers,
+                                backend).result()
+                        result['folder'] = name
+                        results.append(result)
+                        if log is not None:
+                            log(f"{name:14} {size:15} {bleed_mode:8} {backend:7} "
+                                f"{result['pages_per_sec']:7.2f} pages/s "
+                                f"{result['output_bytes'] / 1024 ** 2:8.1f} MB "
+                                f"peak {result['peak_rss'] / 1024 ** 2:6.0f} MB")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': PIL.__version__,
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def case_key(result):
+    # Results from before backends were benchmarked all used Pillow
+    return (result['folder'], result['size'], result['bleed_mode'],
+            result.get('backend', 'pillow'))
+
+
+def backend_summary(results):
+    # Resample seconds per page for each backend over the whole run
+    totals = {}
+    for result in results:
+        seconds, pages = totals.get(result['backend'], (0.0, 0))
+        totals[result['backend']] = (
+            seconds + result['stage_times'].get('resample', 0.0),
+            pages + result['pages'])
+    return {backend: round(seconds / pages, 4) if pages else None
+            for backend, (seconds, pages) in totals.items()}
+
+
+def compare(results, baseline, log):
+    # Print the speed of each case relative to the same case in baseline
+    previous = {case_key(r): r for r in baseline.get('results', [])}
+    for result in results:
+        old = previous.get(case_key(result))
+        if not old or not old.get('pages_per_sec') or not result['pages_per_sec']:
+            continue
+        ratio = result['pages_per_sec'] / old['pages_per_sec']
+        log(f"{result['folder']:14} {result['size']:15} {result['bleed_mode']:8} "
+            f"{result['backend']:7} {ratio:6.2f}x")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the book build pipeline.")
+    parser.add_argument("--suite", choices=SUITES, default="quick")
+    parser.add_argument("--type", dest="file_type", choices=["DOCX", "PDF"],
+                        default="PDF")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS,
+                        default=["pillow"],
+                        help="Resampling backends to time against each other")
+    parser.add_argument("--output", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    args = parser.parse_args(argv)
+    for backend in args.backends:
+        if not backend_available(backend):
+            parser.error(f"the '{backend}' backend is not available here")
+
+    log = lambda line: print(line, file=sys.stderr)
+    started = time.time()
+    results = run_suite(SUITES[args.suite], args.file_type, args.workers,
+                        args.seed, log, args.backends)
+    summary = backend_summary(results)
+    for backend, seconds in sorted(summary.items(), key=lambda item: item[1] or 0):
+        log(f"{backend:7} {seconds:.3f}s resampling per page")
+    data = {
+        'suite': args.suite,
+        'file_type': args.file_type,
+        'workers': args.workers,
+        'seed': args.seed,
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(started)),
+        'environment': environment(),
+        'resample_per_page': summary,
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+        log("Speed relative to " + args.compare)
+        compare(results, baseline, log)
+    return 0
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import sys
+from kdp_files import atomic_write
+
+# Rendered pages are kept on disk between builds so a rebuild only has to
+# resample pages whose source or render settings changed.
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+
+def default_cache_dir(*parts):
+    root = os.environ.get('KDP_CACHE_DIR')
+    if not root:
+        if sys.platform == "win32":
+            base = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+            root = os.path.join(base, 'KDP Format Tool', 'cache')
+        else:
+            base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+            root = os.path.join(base, 'kdp-format')
+    return os.path.join(root, *parts)
+
+
+def source_key(file_path, spec):
+    # Fingerprint of a rendered page: the source is identified by its path,
+    # size and modification time; spec covers pixel size, resampling filter,
+    # bleed mode and encoding. None if the source cannot be read.
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    source = f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}"
+    return hashlib.sha1(f"{source}|{spec!r}".encode('utf-8')).hexdigest()
+
+
+def cache_entries(directory):
+    # (path, size, mtime) of every file under directory
+    for root, _, files in os.walk(directory):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            yield path, stat.st_size, stat.st_mtime
+
+
+def evict_lru(directory, max_bytes):
+    # Drop the least recently used files until we are well under max_bytes.
+    # Readers touch a file's mtime on every hit. Returns the bytes left.
+    entries = sorted(cache_entries(directory), key=lambda entry: entry[2])
+    total = sum(size for _, size, _ in entries)
+    limit = max_bytes * 0.9
+    for path, size, _ in entries:
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+    return total
+
+
+class RenderCache:
+    def __init__(self, directory=None, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory or default_cache_dir('renders')
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._total_bytes = None  # Measured on the first write
+        os.makedirs(self.directory, exist_ok=True)
+
+    def key(self, file_path, spec):
+        return source_key(file_path, spec)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.page')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Mark as recently used for eviction
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # A crash never leaves half a page behind
+        try:
+            atomic_write(path, data)
+        except OSError:
+            return
+        if self._total_bytes is None:
+            self._total_bytes = sum(size for _, size, _ in cache_entries(self.directory))
+        else:
+            self._total_bytes += len(data)
+        if self._total_bytes > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        self._total_bytes = evict_lru(self.directory, self.max_bytes)
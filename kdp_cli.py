@@ -0,0 +1,348 @@
+import argparse
+import configparser
+import os
+import sys
+import threading
+from dataclasses import replace
+from multiprocessing import freeze_support
+from kdp_cache import RenderCache
+from kdp_color import COLOR_MODES, INTENTS
+from kdp_encode import ENCODINGS
+from kdp_index import forget_folder
+from kdp_progress import json_lines_listener
+from kdp_project import project_image_files
+from kdp_render import (BLEED_MODES, FILE_TYPES, BookSettings, BuildError,
+                        COMMON_SIZES, PROOF_PPI, build_book, proof_settings,
+                        trim_size)
+from kdp_resample import BACKENDS, QUALITIES, STRIP_MEGAPIXELS
+from kdp_watch import POLL_INTERVAL, FolderWatcher
+
+# Headless entry point. Builds books straight from arguments or from a
+# manifest without ever importing tkinter, so it runs on display-less boxes.
+#
+#   python kdp_cli.py build FOLDER --size "6 x 9 in" --type PDF
+#   python kdp_cli.py build FOLDER --size "6 x 9 in" --proof 72
+#   python kdp_cli.py watch FOLDER --size "6 x 9 in" --type PDF
+#   python kdp_cli.py batch books.ini
+#
+# A manifest is an INI file with one section per book, named after its
+# output file unless output_filename is given. It uses the same keys as the
+# [Settings] section of settings.ini plus bleed_mode, keep_docx,
+# output_folder, stream_pdf, incremental, resample_quality,
+# resample_backend, strip_megapixels, passthrough, encoding, jpeg_quality,
+# png_compress_level, proof, ppi, skip_broken, color, output_profile,
+# color_intent and trim_size. Values in [DEFAULT] apply to every book, and an
+# image_sequence of '|'-separated file names fixes the page order. Without
+# one, the order saved by the GUI in the folder's kdp_project.json is used,
+# falling back to the sorted folder listing.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Build KDP ready PDF/DOCX books from image folders.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Build a single book")
+    add_book_arguments(build)
+
+    watch = commands.add_parser(
+        "watch", help="Build a book, then rebuild it whenever its pages change")
+    add_book_arguments(watch)
+    watch.add_argument("--interval", type=float, default=POLL_INTERVAL,
+                       help="Seconds a new page must stay unchanged before "
+                            "it is picked up")
+    watch.add_argument("--poll", dest="use_inotify", action="store_false",
+                       help="Poll the folder instead of using inotify, e.g. "
+                            "on network shares")
+
+    batch = commands.add_parser("batch", help="Build every book in a manifest")
+    batch.add_argument("manifest")
+
+    for command in (build, watch, batch):
+        command.add_argument("--workers", type=int, default=None,
+                             help="Render processes, defaults to one per core")
+        command.add_argument("--cache-dir", default=None,
+                             help="Where rendered pages are cached between builds")
+        command.add_argument("--cache-size", type=int, default=2048,
+                             help="Render cache size cap in MB")
+        command.add_argument("--no-cache", dest="use_cache",
+                             action="store_false",
+                             help="Resample every page even if it is cached")
+        command.add_argument("--progress", choices=["none", "json"],
+                             default="none",
+                             help="'json' writes one progress event per line "
+                                  "to stdout")
+    return parser
+
+
+def add_book_arguments(command):
+    command.add_argument("input_folder")
+    size = command.add_mutually_exclusive_group()
+    size.add_argument("--size", choices=COMMON_SIZES,
+                      help="KDP trim size template, bleed is added when needed")
+    size.add_argument("--page-size", nargs=2, type=float,
+                      metavar=("WIDTH", "HEIGHT"), help="Page size in inches")
+    command.add_argument("--top-margin", type=float, default=0.0)
+    command.add_argument("--bottom-margin", type=float, default=0.0)
+    command.add_argument("--left-margin", type=float, default=0.0,
+                         help="Inside margin")
+    command.add_argument("--right-margin", type=float, default=0.0,
+                         help="Outside margin")
+    command.add_argument("--gutter", type=float, default=0.0)
+    command.add_argument("--bleed-mode", choices=BLEED_MODES,
+                         default="Bleed")
+    command.add_argument("--type", dest="file_type", choices=FILE_TYPES,
+                         default="PDF")
+    command.add_argument("--no-keep-docx", dest="keep_docx",
+                         action="store_false",
+                         help="Delete the DOCX after a PDF build")
+    command.add_argument("--output", dest="output_filename", default="Output")
+    command.add_argument("--output-folder", default="",
+                         help="Defaults to the input folder")
+    command.add_argument("--quality", dest="resample_quality",
+                         choices=QUALITIES, default="exact",
+                         help="'fast' uses JPEG draft decoding and integer "
+                              "reduction before the final filter")
+    command.add_argument("--backend", dest="resample_backend",
+                         choices=BACKENDS, default="pillow",
+                         help="Resampling implementation; 'numpy' needs NumPy")
+    command.add_argument("--strip-megapixels", type=int, default=STRIP_MEGAPIXELS,
+                         metavar="MP",
+                         help="Resample sources larger than this in bands of "
+                              "rows to cap memory per page, 0 to never "
+                              f"(default {STRIP_MEGAPIXELS}). The cap only fully "
+                              "holds for BMP, uncompressed TIFF and JPEG; "
+                              "larger PNG and compressed TIFF sources are "
+                              "still decoded whole, one page at a time")
+    command.add_argument("--passthrough", action="store_true",
+                         help="Embed JPEG/PNG pages that already match the page "
+                              "pixel size without re-encoding them")
+    command.add_argument("--encoding", choices=ENCODINGS, default="png",
+                         help="'auto' picks PNG for line art and JPEG for photos")
+    command.add_argument("--jpeg-quality", type=int, default=90)
+    command.add_argument("--png-compress-level", type=int, default=6,
+                         choices=range(10), metavar="0-9")
+    command.add_argument("--stream-pdf", action="store_true",
+                         help="Write PDF pages to disk as they are rendered. "
+                              "Memory only stays flat on very large books with "
+                              "--no-keep-docx too, as the DOCX is still built "
+                              "in memory")
+    command.add_argument("--proof", nargs="?", type=int, const=PROOF_PPI,
+                         default=None, metavar="PPI",
+                         help="Quick low resolution proof for checking page "
+                              "order and margins, written as <output>-proof "
+                              f"(default {PROOF_PPI} PPI)")
+    command.add_argument("--color", choices=COLOR_MODES, default="keep",
+                         help="Convert pages to grayscale or CMYK after "
+                              "resampling; CMYK pages are written as JPEG")
+    command.add_argument("--output-profile", default="",
+                         help="Gray or CMYK ICC profile for colour managed "
+                              "conversion; required for CMYK")
+    command.add_argument("--intent", dest="color_intent", choices=INTENTS,
+                         default="perceptual", help="ICC rendering intent")
+    command.add_argument("--skip-broken", action="store_true",
+                         help="Leave out pages that cannot be read instead "
+                              "of failing the build")
+    command.add_argument("--incremental", action="store_true",
+                         help="Stream the PDF and keep a page manifest next "
+                              "to it, so the next build only renders pages "
+                              "that changed")
+
+
+def settings_from_args(args):
+    settings = book_settings_from_args(args)
+    if args.proof is not None:
+        settings = proof_settings(settings, args.proof)
+    return settings
+
+
+def book_settings_from_args(args):
+    if args.size:
+        page_width, page_height = trim_size(args.size, args.bleed_mode)
+    elif args.page_size:
+        page_width, page_height = args.page_size
+    else:
+        page_width, page_height = trim_size("8.5 x 11 in", args.bleed_mode)
+    return BookSettings(
+        input_folder=args.input_folder,
+        output_filename=args.output_filename,
+        file_type=args.file_type,
+        page_width=page_width,
+        page_height=page_height,
+        top_margin=args.top_margin,
+        bottom_margin=args.bottom_margin,
+        left_margin=args.left_margin,
+        right_margin=args.right_margin,
+        gutter=args.gutter,
+        bleed_mode=args.bleed_mode,
+        keep_docx=args.keep_docx,
+        output_folder=args.output_folder,
+        stream_pdf=args.stream_pdf,
+        resample_quality=args.resample_quality,
+        resample_backend=args.resample_backend,
+        strip_megapixels=args.strip_megapixels,
+        passthrough=args.passthrough,
+        encoding=args.encoding,
+        jpeg_quality=args.jpeg_quality,
+        png_compress_level=args.png_compress_level,
+        incremental=args.incremental,
+        skip_broken=args.skip_broken,
+        color=args.color,
+        output_profile=args.output_profile,
+        color_intent=args.color_intent)
+
+
+def read_manifest(path):
+    # The books of a manifest, as (name, configparser section)
+    manifest = configparser.ConfigParser()
+    try:
+        if not manifest.read(path):
+            raise BuildError("Error", f"Manifest {path} could not be read.")
+    except configparser.Error as e:
+        raise BuildError("Error", f"Manifest {path} could not be read ({e}).")
+    return [(name, manifest[name]) for name in manifest.sections()]
+
+
+def manifest_book(name, section):
+    # (settings, image_files) for one book of a manifest; raises BuildError
+    # when its section has a value that cannot be used
+    sequence = section.get('image_sequence', '')
+    image_files = [f for f in sequence.split('|') if f] or None
+    settings = BookSettings.from_section(section)
+    if image_files is None and os.path.isdir(settings.input_folder):
+        image_files = project_image_files(settings.input_folder)
+    if 'output_filename' not in section:
+        # Name the output after its manifest section
+        settings = replace(settings, output_filename=name)
+    return settings, image_files
+
+
+def run_book(name, settings, image_files, args, cache):
+    listener = None
+    out = sys.stdout
+    if args.progress == "json":
+        # Keep stdout pure JSON lines, the summary goes to stderr
+        emit = json_lines_listener(sys.stdout)
+        listener = lambda event: emit({'book': name, **event})
+        out = sys.stderr
+    try:
+        report = build_book(settings, image_files, workers=args.workers,
+                            cache=cache, progress=listener)
+    except BuildError as e:
+        print(f"{name}: {e.message}", file=sys.stderr)
+        return False
+    for filename in report.skipped:
+        print(f"{name}: skipped unreadable page {filename}", file=sys.stderr)
+    for issue in report.warnings:
+        print(f"{name}: warning: {issue.filename} {issue.message}", file=sys.stderr)
+    print(f"{name}: {report.pages} pages in {report.elapsed:.1f}s -> "
+          f"{', '.join(report.outputs)}", file=out)
+    if report.cached:
+        print(f"{name}:   {report.cached} pages reused from the render cache",
+              file=out)
+    if report.passed_through:
+        print(f"{name}:   {report.passed_through} pages embedded as is", file=out)
+    if report.reused:
+        print(f"{name}:   {report.reused} unchanged pages copied from the "
+              f"previous build", file=out)
+    if report.deduplicated:
+        print(f"{name}:   {report.deduplicated} repeated pages share an image",
+              file=out)
+    print(f"{name}:   {report.output_bytes / 1024 ** 2:.1f} MB written, "
+          f"{report.page_bytes / 1024 ** 2:.1f} MB of page images encoded "
+          f"in {report.encode_time:.1f}s", file=out)
+    if 'color' in report.stage_times and report.pages:
+        color_time = report.stage_times['color']
+        print(f"{name}:   colour conversion {color_time:.1f}s, "
+              f"{color_time / report.pages * 1000:.0f} ms per page", file=out)
+    for sink_name, elapsed in report.sink_times.items():
+        print(f"{name}:   {sink_name} writer {elapsed:.1f}s", file=out)
+    if report.peak_rss:
+        print(f"{name}:   peak memory {report.peak_rss / 1024 ** 2:.0f} MB",
+              file=out)
+    return True
+
+
+def book_image_files(folder_path):
+    if os.path.isdir(folder_path):
+        # Follow the page order arranged in the GUI, if any
+        return project_image_files(folder_path)
+    return None
+
+
+def watch_book(args, cache):
+    # Build once, then rebuild after every batch of page changes. Builds are
+    # incremental and unchanged pages otherwise come from the render cache,
+    # so a rebuild only resamples the pages that were added or edited.
+    settings = replace(settings_from_args(args), incremental=True)
+    changed = threading.Event()
+
+    def on_change(added, modified, removed):
+        for kind, names in (("added", added), ("changed", modified),
+                            ("removed", removed)):
+            for filename in names:
+                print(f"{args.output_filename}: {kind} {filename}", file=sys.stderr)
+        changed.set()
+
+    watcher = FolderWatcher(args.input_folder, on_change, args.interval,
+                            args.use_inotify).start()
+    print(f"Watching {args.input_folder} ({watcher.backend}), "
+          f"Ctrl+C to stop", file=sys.stderr)
+    try:
+        run_book(args.output_filename, settings,
+                 book_image_files(args.input_folder), args, cache)
+        while True:
+            changed.wait()
+            changed.clear()
+            forget_folder(args.input_folder)
+            run_book(args.output_filename, settings,
+                     book_image_files(args.input_folder), args, cache)
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        watcher.stop()
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    cache = None
+    if args.use_cache:
+        cache = RenderCache(args.cache_dir, args.cache_size * 1024 ** 2)
+    if args.command == "build":
+        ok = run_book(args.output_filename, settings_from_args(args),
+                      book_image_files(args.input_folder), args, cache)
+        return 0 if ok else 1
+    if args.command == "watch":
+        if not os.path.isdir(args.input_folder):
+            print(f"{args.input_folder} is not a folder", file=sys.stderr)
+            return 1
+        return watch_book(args, cache)
+
+    # Books are built back to back in this process. A book that fails, for
+    # whatever reason, counts as one failure and the batch goes on.
+    try:
+        books = read_manifest(args.manifest)
+    except BuildError as e:
+        print(e.message, file=sys.stderr)
+        return 1
+    failed = 0
+    for name, section in books:
+        try:
+            settings, image_files = manifest_book(name, section)
+        except BuildError as e:
+            print(e.message, file=sys.stderr)  # Already names the section
+            failed += 1
+            continue
+        try:
+            ok = run_book(name, settings, image_files, args, cache)
+        except Exception as e:
+            print(f"{name}: {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        if not ok:
+            failed += 1
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    freeze_support()
+    sys.exit(main())
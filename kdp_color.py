@@ -0,0 +1,110 @@
+import hashlib
+import os
+from io import BytesIO
+
+# Optional colour conversion of rendered pages, for grayscale interiors and
+# CMYK print files. It runs after resampling, on the page-sized image.
+#
+# With an output ICC profile the conversion goes through littleCMS: from
+# the profile embedded in the source (sRGB when there is none) to the
+# output profile with the chosen rendering intent. Building a transform
+# is far slower than applying it, so each one is built once per process
+# and kept in _transforms; render workers live for the whole build, so
+# every worker builds each transform once. Grayscale without a profile
+# uses Pillow's plain formula, which is quick but not colour managed. CMYK
+# always needs a profile: the plain formula never puts ink in K, so black
+# prints as a muddy four-colour mix.
+#
+# ImageCms is imported on first use, as most books never need it.
+
+COLOR_MODES = ('keep', 'gray', 'cmyk')
+TARGET_MODES = {'gray': 'L', 'cmyk': 'CMYK'}
+
+# Names of the ImageCms.Intent members
+INTENTS = {
+    'perceptual': 'PERCEPTUAL',
+    'relative': 'RELATIVE_COLORIMETRIC',
+    'saturation': 'SATURATION',
+    'absolute': 'ABSOLUTE_COLORIMETRIC',
+}
+
+# Source modes littleCMS takes as they are; anything else goes to RGB first
+CMS_INPUT_MODES = ('L', 'RGB', 'CMYK')
+
+_profiles = {}  # key -> ImageCmsProfile
+_transforms = {}  # (source key, target key, in mode, out mode, intent) -> transform
+
+
+def _profile(key, load):
+    profile = _profiles.get(key)
+    if profile is None:
+        profile = _profiles[key] = load()
+    return profile
+
+
+def output_profile(path):
+    from PIL import ImageCms
+    # Keyed on the file's mtime too, so an edited profile is picked up
+    key = ('file', os.path.abspath(path), os.stat(path).st_mtime_ns)
+    return key, _profile(key, lambda: ImageCms.ImageCmsProfile(path))
+
+
+def source_profile(icc_profile):
+    # The profile embedded in a source image, or sRGB
+    from PIL import ImageCms
+    if not icc_profile:
+        return 'sRGB', _profile('sRGB', lambda: ImageCms.ImageCmsProfile(
+            ImageCms.createProfile('sRGB')))
+    key = ('embedded', hashlib.sha1(icc_profile).hexdigest())
+    return key, _profile(key, lambda: ImageCms.ImageCmsProfile(BytesIO(icc_profile)))
+
+
+def check_output_profile(path, color):
+    # Raises ValueError unless path is an ICC profile usable for color, or
+    # color can do without one
+    if not path:
+        if color == 'cmyk':
+            raise ValueError("CMYK output needs a CMYK ICC profile as the "
+                             "output profile")
+        return
+    from PIL import ImageCms
+    try:
+        key, profile = output_profile(path)
+    except (OSError, ImageCms.PyCMSError) as e:
+        raise ValueError(f"{path} is not a readable ICC profile ({e})")
+    space = profile.profile.xcolor_space.strip()
+    expected = 'GRAY' if color == 'gray' else 'CMYK'
+    if space != expected:
+        raise ValueError(f"{path} is a {space} profile, a {expected} one is needed "
+                         f"for {color} output")
+
+
+def convert_color(image, color, profile_path='', intent='perceptual',
+                  icc_profile=None):
+    # icc_profile is the source's embedded profile, read before resampling
+    if color == 'keep':
+        return image
+    target_mode = TARGET_MODES[color]
+    if not profile_path:
+        if image.mode == target_mode:
+            return image
+        if image.mode not in ('L', 'RGB', 'CMYK'):
+            image = image.convert('RGB')
+        return image.convert(target_mode)
+
+    from PIL import ImageCms
+    if image.mode not in CMS_INPUT_MODES:
+        image = image.convert('RGB')
+        icc_profile = None  # The conversion left the embedded profile behind
+    source_key, source = source_profile(icc_profile)
+    if image.mode != 'RGB' and source_key == 'sRGB':
+        # No embedded profile to describe a gray or CMYK source
+        return image if image.mode == target_mode else image.convert(target_mode)
+    target_key, target = output_profile(profile_path)
+    key = (source_key, target_key, image.mode, target_mode, intent)
+    transform = _transforms.get(key)
+    if transform is None:
+        transform = _transforms[key] = ImageCms.buildTransform(
+            source, target, image.mode, target_mode,
+            getattr(ImageCms.Intent, INTENTS[intent]))
+    return ImageCms.applyTransform(image, transform)
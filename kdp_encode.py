@@ -0,0 +1,41 @@
+from io import BytesIO
+from PIL import Image
+
+# How rendered pages are encoded before they are embedded.
+#
+# "png" is lossless and what the tool has always written. "jpeg" is much
+# smaller and faster to write for photographic pages. "auto" picks PNG for
+# line art and flat colour pages and JPEG for everything else.
+ENCODINGS = ('png', 'jpeg', 'auto')
+
+# A page sampled down to this size with more distinct colours than
+# LINE_ART_COLORS is treated as a photo
+LINE_ART_SAMPLE = (256, 256)
+LINE_ART_COLORS = 1024
+
+# Modes the PNG encoder can write as they are
+PNG_MODES = ('1', 'L', 'LA', 'I', 'I;16', 'P', 'RGB', 'RGBA')
+
+
+def is_line_art(image):
+    # Nearest neighbour keeps the exact pixel values, a smoothing filter
+    # would invent in-between colours along every edge
+    sample = image.resize(LINE_ART_SAMPLE, Image.NEAREST)
+    if sample.mode not in ('L', 'RGB'):
+        sample = sample.convert('RGB')
+    return sample.getcolors(LINE_ART_COLORS) is not None
+
+
+def encode_page(image, encoding='png', jpeg_quality=90, png_compress_level=6):
+    if encoding == 'auto':
+        encoding = 'png' if is_line_art(image) else 'jpeg'
+    buffer = BytesIO()
+    if encoding == 'jpeg':
+        if image.mode not in ('L', 'RGB', 'CMYK'):
+            image = image.convert('RGB')
+        image.save(buffer, format='JPEG', quality=jpeg_quality)
+    else:
+        if image.mode not in PNG_MODES:
+            image = image.convert('RGB')  # e.g. CMYK scans
+        image.save(buffer, format='PNG', compress_level=png_compress_level)
+    return buffer.getvalue()
@@ -0,0 +1,34 @@
+import os
+import tempfile
+
+# Files other processes (or the next run) may read while they are being
+# replaced: project files, incremental manifests and cached pages.
+
+# mkstemp creates its file readable by the owner only, and the rename would
+# carry that over to files in folders the team shares. Read once, as the
+# umask can only be read by setting it.
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+def atomic_write(path, data):
+    # Write data (bytes) to a temp file next to path and rename it over
+    # path, so readers see the old file or the new one, never half of one
+    folder = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(
+        dir=folder, prefix='.' + os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        # Keep the mode of the file being replaced, or give a new one the
+        # mode open() would
+        try:
+            mode = os.stat(path).st_mode & 0o777
+        except FileNotFoundError:
+            mode = 0o666 & ~_UMASK
+        os.chmod(temp_path, mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
@@ -0,0 +1,73 @@
+import os
+import threading
+from dataclasses import dataclass
+from kdp_render import IMAGE_EXTENSIONS, sort_image_files
+
+# A cached listing of the images in a folder. The folder is read with a
+# single os.scandir pass, which on Windows and most SMB shares returns each
+# file's size and modification time with the listing itself, and the result
+# is reused until the folder's own mtime changes (adding, removing or
+# renaming a file updates it).
+
+
+@dataclass(frozen=True)
+class ImageEntry:
+    name: str
+    size: int
+    mtime_ns: int
+
+
+class FolderIndex:
+    def __init__(self, folder_path, mtime_ns, entries):
+        self.folder_path = folder_path
+        self.mtime_ns = mtime_ns
+        self.entries = entries  # name -> ImageEntry
+        self.names = sort_image_files(entries)
+        self.name_set = frozenset(entries)
+
+    def __contains__(self, name):
+        return name in self.name_set
+
+    def __len__(self):
+        return len(self.names)
+
+
+_indexes = {}  # abspath -> FolderIndex
+_indexes_lock = threading.Lock()
+
+
+def scan_folder(folder_path):
+    entries = {}
+    with os.scandir(folder_path) as it:
+        for entry in it:
+            if not entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries[entry.name] = ImageEntry(entry.name, stat.st_size, stat.st_mtime_ns)
+    return entries
+
+
+def folder_index(folder_path):
+    # The index for folder_path, rescanned only when the folder changed
+    key = os.path.abspath(folder_path)
+    mtime_ns = os.stat(folder_path).st_mtime_ns
+    with _indexes_lock:
+        previous = _indexes.get(key)
+    if previous is not None and previous.mtime_ns == mtime_ns:
+        return previous
+    index = FolderIndex(folder_path, mtime_ns, scan_folder(folder_path))
+    with _indexes_lock:
+        _indexes[key] = index
+    return index
+
+
+def forget_folder(folder_path):
+    # Drop a cached index, e.g. after copying files in within the same
+    # mtime tick on file systems with coarse timestamps
+    with _indexes_lock:
+        _indexes.pop(os.path.abspath(folder_path), None)
@@ -0,0 +1,160 @@
+import itertools
+import threading
+import traceback
+from collections import deque
+from dataclasses import dataclass, field
+from kdp_render import BuildCancelled, BuildError, build_book
+
+# A queue of books to build. Every job carries its own frozen BookSettings
+# and page list, taken when it was queued, so later edits in the GUI never
+# leak into a build that is already waiting or running. Jobs run on a small
+# fixed number of scheduler threads; each build still renders its pages on
+# its own process pool, so one runner is usually enough to keep every core
+# busy.
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+
+@dataclass
+class Job:
+    id: int
+    name: str
+    settings: object  # BookSettings
+    image_files: tuple
+    status: str = QUEUED
+    attempts: int = 0
+    done: int = 0  # Pages finished in the current attempt
+    total: int = 0
+    report: object = None  # BuildReport once done
+    error: str = ''
+    error_title: str = ''
+    cancel_event: threading.Event = field(default_factory=threading.Event,
+                                          repr=False, compare=False)
+
+
+class JobQueue:
+    def __init__(self, runners=1, build_workers=None, cache=None,
+                 on_status=None, on_progress=None, retries=1):
+        # on_status(job) and on_progress(job, event) are called on runner
+        # threads. Unexpected errors (a share dropping out, say) are retried
+        # up to retries times; BuildErrors are not, they need the user.
+        self.build_workers = build_workers
+        self.cache = cache
+        self.on_status = on_status
+        self.on_progress = on_progress
+        self.retries = retries
+        self._ids = itertools.count(1)
+        self._jobs = {}
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._runners = [threading.Thread(target=self._run, daemon=True)
+                         for _ in range(runners)]
+        for runner in self._runners:
+            runner.start()
+
+    def submit(self, name, settings, image_files=None):
+        job = Job(next(self._ids), name, settings,
+                  tuple(image_files) if image_files is not None else None)
+        with self._condition:
+            self._jobs[job.id] = job
+            self._queue.append(job)
+            self._condition.notify()
+        self._status(job)
+        return job
+
+    def jobs(self):
+        with self._condition:
+            return list(self._jobs.values())
+
+    def get(self, job_id):
+        with self._condition:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        # A queued job is dropped at once; a running one stops after the
+        # page it is on and leaves no partial output behind
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (QUEUED, RUNNING):
+                return False
+            job.cancel_event.set()
+            if job.status == QUEUED:
+                self._queue.remove(job)
+                job.status = CANCELLED
+            else:
+                return True
+        self._status(job)
+        return True
+
+    def retry(self, job_id):
+        # Queue a failed or cancelled job again with the same snapshot
+        with self._condition:
+            job = self._jobs.get(job_id)
+            if job is None or job.status not in (FAILED, CANCELLED):
+                return False
+            job.cancel_event.clear()
+            job.status = QUEUED
+            job.error = job.error_title = ''
+            self._queue.append(job)
+            self._condition.notify()
+        self._status(job)
+        return True
+
+    def pending(self):
+        # Jobs that are queued or running
+        with self._condition:
+            return sum(job.status in (QUEUED, RUNNING) for job in self._jobs.values())
+
+    def _status(self, job):
+        if self.on_status is not None:
+            self.on_status(job)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                job = self._queue.popleft()
+                job.status = RUNNING
+                job.attempts += 1
+                job.done = job.total = 0
+            self._status(job)
+            self._build(job)
+            self._status(job)
+
+    def _progress(self, job, event):
+        if event['event'] == 'start':
+            job.total = event['total']
+        elif event['event'] == 'page':
+            job.done = event['done']
+        if self.on_progress is not None:
+            self.on_progress(job, event)
+
+    def _build(self, job):
+        try:
+            report = build_book(
+                job.settings,
+                list(job.image_files) if job.image_files is not None else None,
+                workers=self.build_workers, cache=self.cache,
+                progress=lambda event: self._progress(job, event),
+                cancel=job.cancel_event)
+        except BuildCancelled:
+            status, job.report = CANCELLED, None
+        except BuildError as e:
+            status, job.error_title, job.error = FAILED, e.title, e.message
+        except Exception as e:
+            traceback.print_exc()
+            status, job.error_title, job.error = FAILED, "Error", str(e)
+            if job.attempts <= self.retries and not job.cancel_event.is_set():
+                status = QUEUED
+        else:
+            status, job.report = DONE, report
+        with self._condition:
+            job.status = status
+            if status == QUEUED:
+                self._queue.append(job)
+                self._condition.notify()
@@ -0,0 +1,78 @@
+import json
+import os
+from kdp_files import atomic_write
+
+# Incremental rebuilds. Next to a streamed PDF the build keeps a manifest
+# listing, page by page, the fingerprint of what was rendered (source file
+# plus the render spec, which covers geometry, bleed mode and encoding) and
+# where that page's image object sits in the PDF. The next build copies the
+# objects of unchanged pages straight out of the old file and only renders
+# pages whose fingerprint is new.
+#
+# The manifest also records the size and mtime of the PDF it describes, so
+# a PDF that was replaced or edited by anything else is never read from.
+
+MANIFEST_SUFFIX = '.kdpmanifest.json'
+MANIFEST_VERSION = 1
+
+
+def manifest_path(output_path):
+    return output_path + MANIFEST_SUFFIX
+
+
+class PreviousOutput:
+    # Image objects of the last build of output_path, by page fingerprint
+    def __init__(self, output_path):
+        self.spans = {}  # fingerprint -> (offset, length)
+        self.file = None
+        try:
+            with open(manifest_path(output_path), encoding='utf-8') as f:
+                data = json.load(f)
+            stat = os.stat(output_path)
+            if data.get('version') != MANIFEST_VERSION \
+                    or data.get('pdf_size') != stat.st_size \
+                    or data.get('pdf_mtime_ns') != stat.st_mtime_ns:
+                return
+            spans = {page['source']: (int(page['offset']), int(page['length']))
+                     for page in data.get('pages', [])}
+            self.file = open(output_path, 'rb')
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        self.spans = spans
+
+    def __contains__(self, source):
+        return source in self.spans
+
+    def read(self, source):
+        offset, length = self.spans[source]
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def close(self):
+        # Must happen before the new file is renamed over the old one
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def save_manifest(output_path, pages, settings):
+    # pages is a list of (fingerprint, (offset, length)) in page order
+    stat = os.stat(output_path)
+    data = {
+        'version': MANIFEST_VERSION,
+        'pdf_size': stat.st_size,
+        'pdf_mtime_ns': stat.st_mtime_ns,
+        'page_size': [settings.page_width, settings.page_height],
+        'bleed_mode': settings.bleed_mode,
+        'encoding': settings.encoding,
+        'pages': [{'source': source, 'offset': offset, 'length': length}
+                  for source, (offset, length) in pages],
+    }
+    atomic_write(manifest_path(output_path), json.dumps(data).encode('utf-8'))
+
+
+def remove_manifest(output_path):
+    try:
+        os.remove(manifest_path(output_path))
+    except OSError:
+        pass
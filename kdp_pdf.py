@@ -0,0 +1,166 @@
+import os
+import struct
+import zlib
+from io import BytesIO
+from PIL import Image
+
+# A minimal PDF writer for books made of one full-page image per page.
+# Every page is written to disk as soon as it is added, so memory use does
+# not grow with the page count. JPEG data and plain 8-bit PNG data are
+# copied byte for byte into the file; anything else is decoded and deflated.
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+COLOR_SPACES = {
+    'L': '/DeviceGray',
+    'RGB': '/DeviceRGB',
+    'CMYK': '/DeviceCMYK',
+}
+
+
+def _png_stream(data):
+    # Return (width, height, colors, idat) for PNGs whose IDAT stream can be
+    # embedded as is, otherwise None
+    if not data.startswith(PNG_SIGNATURE):
+        return None
+    pos = len(PNG_SIGNATURE)
+    header = None
+    idat = []
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        chunk = data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+        if kind == b'IHDR':
+            header = struct.unpack('>IIBBBBB', chunk)
+        elif kind == b'IDAT':
+            idat.append(chunk)
+        elif kind == b'IEND':
+            break
+    if header is None or not idat:
+        return None
+    width, height, bit_depth, color_type, _, _, interlace = header
+    # Gray or RGB without alpha, 8 bits and not interlaced
+    if bit_depth != 8 or interlace or color_type not in (0, 2):
+        return None
+    colors = 1 if color_type == 0 else 3
+    return width, height, colors, b''.join(idat)
+
+
+def image_xobject(data):
+    # Build the dictionary entries and stream for an encoded page image
+    png = _png_stream(data)
+    if png is not None:
+        width, height, colors, idat = png
+        color_space = '/DeviceGray' if colors == 1 else '/DeviceRGB'
+        entries = (f'/Width {width} /Height {height} /ColorSpace {color_space} '
+                   f'/BitsPerComponent 8 /Filter /FlateDecode '
+                   f'/DecodeParms << /Predictor 15 /Colors {colors} '
+                   f'/BitsPerComponent 8 /Columns {width} >>')
+        return entries, idat
+
+    image = Image.open(BytesIO(data))
+    if image.format == 'JPEG' and image.mode in COLOR_SPACES:
+        entries = (f'/Width {image.width} /Height {image.height} '
+                   f'/ColorSpace {COLOR_SPACES[image.mode]} '
+                   f'/BitsPerComponent 8 /Filter /DCTDecode')
+        if image.mode == 'CMYK':
+            # Adobe CMYK JPEGs are stored inverted
+            entries += ' /Decode [1 0 1 0 1 0 1 0]'
+        return entries, data
+
+    if image.mode not in COLOR_SPACES:
+        image = image.convert('RGB')
+    entries = (f'/Width {image.width} /Height {image.height} '
+               f'/ColorSpace {COLOR_SPACES[image.mode]} '
+               f'/BitsPerComponent 8 /Filter /FlateDecode')
+    return entries, zlib.compress(image.tobytes())
+
+
+class StreamingPdfWriter:
+    def __init__(self, path, page_width_pt, page_height_pt):
+        self.path = path
+        self.page_width_pt = page_width_pt
+        self.page_height_pt = page_height_pt
+        # Written next to the target and renamed into place on close
+        self.temp_path = path + '.part'
+        self.file = open(self.temp_path, 'wb')
+        self.offsets = {}
+        self.spans = {}  # Image object id -> (offset, length) of its body
+        self.page_ids = []
+        self.next_id = 3  # 1 is the catalog and 2 the page tree
+        self.file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _new_id(self):
+        object_id = self.next_id
+        self.next_id += 1
+        return object_id
+
+    def _write_object(self, object_id, body, stream=None):
+        self.offsets[object_id] = self.file.tell()
+        self.file.write(f'{object_id} 0 obj\n'.encode('ascii'))
+        if stream is None:
+            self.file.write(body.encode('ascii'))
+        else:
+            self.file.write(f'<< {body} /Length {len(stream)} >>\nstream\n'.encode('ascii'))
+            self.file.write(stream)
+            self.file.write(b'\nendstream')
+        self.file.write(b'\nendobj\n')
+
+    def add_image(self, data):
+        # Write the image XObject and return its object id
+        entries, stream = image_xobject(data)
+        image_id = self._new_id()
+        self._write_object(image_id, '/Type /XObject /Subtype /Image ' + entries, stream)
+        self._record_span(image_id)
+        return image_id
+
+    def add_image_object(self, body):
+        # Write an image XObject copied from an earlier file written by this
+        # class, body being the bytes between 'obj' and 'endobj'
+        image_id = self._new_id()
+        self.offsets[image_id] = self.file.tell()
+        self.file.write(f'{image_id} 0 obj\n'.encode('ascii'))
+        self.file.write(body)
+        self.file.write(b'\nendobj\n')
+        self._record_span(image_id)
+        return image_id
+
+    def _record_span(self, image_id):
+        start = self.offsets[image_id] + len(f'{image_id} 0 obj\n')
+        self.spans[image_id] = (start, self.file.tell() - len(b'\nendobj\n') - start)
+
+    def add_page(self, image_id, width, height):
+        # Place the image at the bottom left corner, scaled to width x height
+        content = f'q {width} 0 0 {height} 0 0 cm /Im0 Do Q'.encode('ascii')
+        content_id = self._new_id()
+        self._write_object(content_id, '', content)
+        page_id = self._new_id()
+        self._write_object(
+            page_id,
+            f'<< /Type /Page /Parent 2 0 R '
+            f'/MediaBox [0 0 {self.page_width_pt:.4f} {self.page_height_pt:.4f}] '
+            f'/Resources << /XObject << /Im0 {image_id} 0 R >> >> '
+            f'/Contents {content_id} 0 R >>')
+        self.page_ids.append(page_id)
+
+    def close(self):
+        kids = ' '.join(f'{page_id} 0 R' for page_id in self.page_ids)
+        self._write_object(
+            2, f'<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>')
+        self._write_object(1, '<< /Type /Catalog /Pages 2 0 R >>')
+
+        xref_offset = self.file.tell()
+        self.file.write(f'xref\n0 {self.next_id}\n'.encode('ascii'))
+        self.file.write(b'0000000000 65535 f \n')
+        for object_id in range(1, self.next_id):
+            self.file.write(f'{self.offsets[object_id]:010d} 00000 n \n'.encode('ascii'))
+        self.file.write(
+            f'trailer\n<< /Size {self.next_id} /Root 1 0 R >>\n'
+            f'startxref\n{xref_offset}\n%%EOF\n'.encode('ascii'))
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def abort(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
@@ -0,0 +1,159 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from PIL import Image
+from kdp_encode import PNG_MODES
+
+# Checks every page before any rendering starts. Only headers are read,
+# plus the last few bytes of JPEG and PNG files to spot truncated copies,
+# so even a large book on a network share is checked in seconds. Files
+# that do not end on their format's end marker are decoded in full before
+# being reported, since some cameras and editors append data after it. The
+# reads run on a thread pool since they mostly wait on the disk.
+
+BROKEN = 'broken'
+TRUNCATED = 'truncated'
+UNSUPPORTED = 'unsupported'
+LOW_RESOLUTION = 'low resolution'
+
+# Modes Pillow can resample and convert to RGB for the encoders
+RENDER_MODES = PNG_MODES + ('PA', 'F', 'RGBX', 'CMYK', 'YCbCr')
+
+# A page is flagged when it would be enlarged by more than this fraction
+UPSCALE_TOLERANCE = 0.01
+
+# Bytes every complete file of the format ends with
+TRAILERS = {
+    'JPEG': b'\xff\xd9',
+    'PNG': b'IEND\xaeB`\x82',
+}
+
+MAX_WORKERS = 16
+
+
+@dataclass(frozen=True)
+class PageHeader:
+    filename: str
+    format: str
+    mode: str
+    size: tuple
+    dpi: tuple  # None when the file does not say
+
+
+@dataclass(frozen=True)
+class PageIssue:
+    filename: str
+    kind: str
+    message: str
+
+    @property
+    def fatal(self):
+        # Low resolution pages still build, just softer
+        return self.kind != LOW_RESOLUTION
+
+
+@dataclass
+class PreflightReport:
+    headers: dict = field(default_factory=dict)  # filename -> PageHeader
+    issues: list = field(default_factory=list)
+    elapsed: float = 0.0
+
+    @property
+    def errors(self):
+        return [issue for issue in self.issues if issue.fatal]
+
+    @property
+    def warnings(self):
+        return [issue for issue in self.issues if not issue.fatal]
+
+
+def _trailer_ok(path, image_format):
+    trailer = TRAILERS.get(image_format)
+    if trailer is None:
+        return True
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        # JPEGs may carry a little padding after the end marker
+        tail_size = min(size, 64) if image_format == 'JPEG' else len(trailer)
+        f.seek(size - tail_size)
+        tail = f.read()
+    if image_format == 'JPEG':
+        return trailer in tail
+    return tail == trailer
+
+
+def _decodes(path):
+    # Slow path for files with bytes after their end marker: a truncated
+    # file fails to decode, one with a harmless appendix does not
+    try:
+        with Image.open(path) as image:
+            image.load()
+    except Exception:
+        return False
+    return True
+
+
+def read_header(path, filename):
+    # Returns (PageHeader or None, [PageIssue])
+    try:
+        with Image.open(path) as image:
+            header = PageHeader(filename, image.format, image.mode, image.size,
+                                image.info.get('dpi'))
+    except Exception as e:
+        return None, [PageIssue(filename, BROKEN, f"cannot be opened ({e})")]
+    if header.size[0] == 0 or header.size[1] == 0:
+        return header, [PageIssue(filename, BROKEN, "has no pixels")]
+    try:
+        if not _trailer_ok(path, header.format) and not _decodes(path):
+            return header, [PageIssue(filename, TRUNCATED,
+                                      "is cut short, copy it again")]
+    except OSError as e:
+        return header, [PageIssue(filename, BROKEN, f"cannot be read ({e})")]
+    return header, []
+
+
+def check_page(header, pixel_size, ppi, check_resolution=True):
+    issues = []
+    if header.mode not in RENDER_MODES:
+        issues.append(PageIssue(header.filename, UNSUPPORTED,
+                                f"uses the {header.mode} colour mode"))
+    if check_resolution:
+        scale = min(header.size[0] / pixel_size[0], header.size[1] / pixel_size[1])
+        if scale < 1 - UPSCALE_TOLERANCE:
+            issues.append(PageIssue(
+                header.filename, LOW_RESOLUTION,
+                f"is {header.size[0]} x {header.size[1]} px, about "
+                f"{int(ppi * scale)} PPI at this page size"))
+    return issues
+
+
+def preflight(folder_path, image_files, pixel_size, ppi, check_resolution=True,
+              workers=None):
+    started = time.perf_counter()
+    report = PreflightReport()
+    filenames = list(dict.fromkeys(image_files))  # Each file once, in order
+    workers = workers or min(MAX_WORKERS, len(filenames)) or 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(
+            lambda filename: read_header(os.path.join(folder_path, filename), filename),
+            filenames)
+        for header, issues in results:
+            report.issues.extend(issues)
+            if header is None:
+                continue
+            report.headers[header.filename] = header
+            if not issues:
+                report.issues.extend(check_page(header, pixel_size, ppi,
+                                                check_resolution))
+    report.elapsed = time.perf_counter() - started
+    return report
+
+
+def describe(issues, limit=10):
+    # One line per issue, for message boxes and the command line
+    lines = [f"{issue.filename} {issue.message}" for issue in issues[:limit]]
+    if len(issues) > limit:
+        lines.append(f"... and {len(issues) - limit} more")
+    return '\n'.join(lines)
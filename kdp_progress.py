@@ -0,0 +1,66 @@
+import json
+import sys
+import time
+
+# Progress events from build_book. A listener is any callable that takes
+# one event dict; events are plain JSON-friendly values so they can be
+# written out as JSON lines by headless runs.
+#
+#   {"event": "start", "total": 300}
+#   {"event": "page", "done": 12, "total": 300, "file": "page-12.jpg",
+#    "skipped": false, "stages": {"decode": 0.41, ...}, "elapsed": 9.8,
+#    "eta": 235.2}
+#   {"event": "finish", "pages": 300, "skipped": 0, "elapsed": 244.1,
+#    "stages": {"decode": 120.3, ...}}
+
+
+class BuildProgress:
+    def __init__(self, total, listener=None):
+        self.total = total
+        self.listener = listener
+        self.done = 0
+        self.stage_totals = {}
+        self.started = time.perf_counter()
+
+    def _emit(self, event):
+        if self.listener is not None:
+            self.listener(event)
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._emit({'event': 'start', 'total': self.total})
+
+    def page(self, filename, stages, skipped=False):
+        self.done += 1
+        for stage, seconds in stages.items():
+            self.stage_totals[stage] = self.stage_totals.get(stage, 0.0) + seconds
+        elapsed = time.perf_counter() - self.started
+        eta = elapsed / self.done * (self.total - self.done)
+        self._emit({
+            'event': 'page',
+            'done': self.done,
+            'total': self.total,
+            'file': filename,
+            'skipped': skipped,
+            'stages': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+            'elapsed': round(elapsed, 3),
+            'eta': round(eta, 1),
+        })
+
+    def finish(self, pages, skipped):
+        self._emit({
+            'event': 'finish',
+            'pages': pages,
+            'skipped': skipped,
+            'elapsed': round(time.perf_counter() - self.started, 3),
+            'stages': {stage: round(seconds, 3)
+                       for stage, seconds in self.stage_totals.items()},
+        })
+
+
+def json_lines_listener(stream=None):
+    def listener(event):
+        out = stream or sys.stdout
+        out.write(json.dumps(event) + '\n')
+        out.flush()
+    return listener
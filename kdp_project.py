@@ -0,0 +1,138 @@
+import json
+import os
+import threading
+import time
+from kdp_files import atomic_write
+from kdp_index import folder_index
+
+# Page order and deleted pages are stored per image folder in a small JSON
+# project file, one list entry per page, instead of a single '|'-joined
+# line in settings.ini. Edits are saved through ProjectWriter, which
+# coalesces bursts of changes and writes from a background thread.
+
+PROJECT_FILE = 'kdp_project.json'
+PROJECT_VERSION = 1
+
+# Quiet period after the last edit before the project file is written
+SAVE_DELAY = 0.5
+
+
+def project_path(folder_path):
+    return os.path.join(folder_path, PROJECT_FILE)
+
+
+def load_project(folder_path):
+    # Returns (image_sequence, deleted_items), or None without a project file
+    try:
+        with open(project_path(folder_path), encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    image_sequence = [str(name) for name in data.get('image_sequence', [])]
+    deleted_items = []
+    for item in data.get('deleted_items', []):
+        try:
+            filename, index = item
+            deleted_items.append((str(filename), int(index)))
+        except (TypeError, ValueError):
+            pass
+    return image_sequence, deleted_items
+
+
+def legacy_project(settings):
+    # Read the sequence that older versions kept in settings.ini
+    image_sequence = [f for f in settings.get('image_sequence', '').split('|') if f]
+    deleted_items = []
+    for item_data in settings.get('deleted_items', '').split('|'):
+        if item_data:
+            try:
+                filename, index_str = item_data.split(':', 1)
+                deleted_items.append((filename, int(index_str)))
+            except ValueError:
+                pass
+    return image_sequence, deleted_items
+
+
+def save_project(folder_path, image_sequence, deleted_items):
+    data = {
+        'version': PROJECT_VERSION,
+        'image_sequence': list(image_sequence),
+        'deleted_items': [[filename, index] for filename, index in deleted_items],
+    }
+    atomic_write(project_path(folder_path),
+                 json.dumps(data, ensure_ascii=False, indent=0).encode('utf-8'))
+
+
+def restore_sequence(image_sequence, deleted_items, existing_files):
+    # Keep the saved order of files that still exist, drop deleted ones and
+    # append files that are new since the sequence was saved. existing_files
+    # is in folder order; lookups go through sets so large folders stay
+    # linear.
+    existing = set(existing_files)
+    deleted_filenames = {filename for filename, index in deleted_items}
+    image_files = [f for f in image_sequence if f in existing and f not in deleted_filenames]
+    placed = set(image_files)
+    new_files = [f for f in existing_files if f not in placed and f not in deleted_filenames]
+    image_files.extend(new_files)
+    return image_files
+
+
+def project_image_files(folder_path):
+    # The page order the GUI saved for a folder, or None if it has none
+    project = load_project(folder_path)
+    if project is None:
+        return None
+    return restore_sequence(*project, folder_index(folder_path).names)
+
+
+class ProjectWriter:
+    def __init__(self, delay=SAVE_DELAY):
+        self.delay = delay
+        self._pending = None  # (generation, folder_path, image_sequence, deleted_items)
+        self._generation = 0
+        self._written = 0
+        self._due = 0.0
+        self._condition = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def schedule(self, folder_path, image_sequence, deleted_items):
+        # Cheap enough to call on every edit; only the latest state is written
+        with self._condition:
+            self._generation += 1
+            self._pending = (self._generation, folder_path,
+                             list(image_sequence), list(deleted_items))
+            self._due = time.monotonic() + self.delay
+            self._condition.notify()
+
+    def flush(self):
+        # Write whatever is pending right away, e.g. before the app exits
+        with self._condition:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self._write(pending)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while self._pending is None or time.monotonic() < self._due:
+                    if self._pending is None:
+                        self._condition.wait()
+                    else:
+                        self._condition.wait(self._due - time.monotonic())
+                pending, self._pending = self._pending, None
+            self._write(pending)
+
+    def _write(self, pending):
+        generation, folder_path, image_sequence, deleted_items = pending
+        with self._write_lock:
+            # flush and the writer thread may race; never let an older
+            # state overwrite a newer one
+            if generation <= self._written:
+                return
+            try:
+                save_project(folder_path, image_sequence, deleted_items)
+            except OSError:
+                pass  # Read-only folder; the sequence just is not remembered
+            self._written = generation
@@ -0,0 +1,670 @@
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field, replace
+from PIL import Image
+from kdp_cache import source_key
+from kdp_color import COLOR_MODES, INTENTS, check_output_profile, convert_color
+from kdp_encode import ENCODINGS, encode_page
+from kdp_preflight import describe, preflight
+from kdp_progress import BuildProgress
+from kdp_resample import (BACKENDS, QUALITIES, STRIP_MEGAPIXELS, backend_available,
+                          decoded_whole, draft_image, oversized, resample,
+                          strip_resample)
+
+# Resolution every page is resampled to before it is embedded
+TARGET_PPI = 330
+
+# Proof builds are for checking order, bleed and margins on screen: low
+# resolution, a cheap filter and JPEG pages, written next to the final
+# output under a separate name
+PROOF_PPI = 96
+PROOF_PPI_RANGE = (36, 150)
+PROOF_FILTER = 'BILINEAR'
+PROOF_JPEG_QUALITY = 75
+PROOF_SUFFIX = '-proof'
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tiff')
+
+FILE_TYPES = ('DOCX', 'PDF')
+BLEED_MODES = ('Bleed', 'No Bleed')
+
+# Settings that only take one of a fixed set of values
+SETTING_CHOICES = {
+    'file_type': FILE_TYPES,
+    'bleed_mode': BLEED_MODES,
+    'encoding': ENCODINGS,
+    'resample_quality': QUALITIES,
+    'resample_backend': tuple(BACKENDS),
+    'color': COLOR_MODES,
+    'color_intent': tuple(INTENTS),
+}
+
+# Common KDP sizes
+COMMON_SIZES = [
+    "5 x 8 in",
+    "5.25 x 8 in",
+    "5.5 x 8.5 in",
+    "6 x 9 in",
+    "5.06 x 7.81 in",
+    "6.14 x 9.21 in",
+    "6.69 x 9.61 in",
+    "7 x 10 in",
+    "7.44 x 9.69 in",
+    "7.5 x 9.25 in",
+    "8 x 10 in",
+    "8.5 x 11 in",
+    "8.27 x 11.69 in",
+    "8.25 x 6 in",
+    "8.25 x 8.25 in",
+    "8.5 x 8.5 in"
+]
+
+# Sources within this fraction of the target pixel size, in a colour mode
+# the writers take as is, can skip resampling when passthrough is enabled
+PASSTHROUGH_TOLERANCE = 0.01
+PASSTHROUGH_MODES = {
+    'JPEG': ('L', 'RGB', 'CMYK'),
+    'PNG': ('L', 'RGB'),
+}
+
+# Oversized sources that are decoded whole (kdp_resample.decoded_whole)
+# can each take gigabytes, so only this many render at once
+LARGE_PAGES_IN_FLIGHT = 1
+
+EMUS_PER_TWIP = 635
+EMUS_PER_PT = 12700
+
+
+class BuildError(Exception):
+    def __init__(self, title, message):
+        super().__init__(message)
+        self.title = title
+        self.message = message
+
+
+class NoImagesError(BuildError):
+    pass
+
+
+class PreflightError(BuildError):
+    def __init__(self, preflight_report):
+        errors = preflight_report.errors
+        super().__init__(
+            "Unusable Pages",
+            f"{len(errors)} page(s) cannot be used, fix or remove them first:\n"
+            + describe(errors))
+        self.report = preflight_report
+
+
+class BuildCancelled(BuildError):
+    def __init__(self):
+        super().__init__("Cancelled", "The build was cancelled.")
+
+
+@dataclass(frozen=True)
+class BookSettings:
+    input_folder: str
+    output_filename: str = 'Output'
+    file_type: str = 'DOCX'
+    page_width: float = 8.27
+    page_height: float = 11.69
+    top_margin: float = 0.0
+    bottom_margin: float = 0.0
+    left_margin: float = 0.0  # left is inside margin
+    right_margin: float = 0.0  # right is outside margin
+    gutter: float = 0.0
+    bleed_mode: str = 'Bleed'
+    keep_docx: bool = True
+    output_folder: str = ''  # Empty means next to the images
+    stream_pdf: bool = False  # Write PDF pages to disk as they are rendered
+    resample_quality: str = 'exact'  # 'fast' decodes and reduces before LANCZOS
+    resample_backend: str = 'pillow'  # One of kdp_resample.BACKENDS
+    passthrough: bool = False  # Embed sources that already fit the page as is
+    encoding: str = 'png'  # 'png', 'jpeg' or 'auto' to pick per page
+    jpeg_quality: int = 90
+    png_compress_level: int = 6
+    incremental: bool = False  # Reuse unchanged pages of the last streamed PDF
+    ppi: int = TARGET_PPI
+    proof: bool = False  # Low resolution layout check, see proof_settings
+    skip_broken: bool = False  # Leave out unusable pages instead of failing
+    color: str = 'keep'  # One of kdp_color.COLOR_MODES
+    output_profile: str = ''  # ICC profile for colour managed conversion
+    color_intent: str = 'perceptual'  # One of kdp_color.INTENTS
+    strip_megapixels: int = STRIP_MEGAPIXELS  # Larger sources resample in bands
+
+    @classmethod
+    def from_section(cls, section):
+        # Build settings from a configparser section laid out like the
+        # [Settings] section of settings.ini. Raises BuildError naming the
+        # section and key for a value that cannot be used, so a batch can
+        # move on to its next book.
+        values = {'input_folder': section.get('input_folder', '')}
+        key = None
+        try:
+            for key in ('output_filename', 'file_type', 'bleed_mode', 'output_folder',
+                        'resample_quality', 'resample_backend', 'encoding', 'color',
+                        'output_profile', 'color_intent'):
+                if key in section:
+                    values[key] = section.get(key)
+            for key in ('jpeg_quality', 'png_compress_level', 'ppi', 'strip_megapixels'):
+                if key in section:
+                    values[key] = section.getint(key)
+            for key in ('page_width', 'page_height', 'top_margin', 'bottom_margin',
+                        'left_margin', 'right_margin', 'gutter'):
+                if key in section:
+                    values[key] = section.getfloat(key)
+            for key in ('keep_docx', 'stream_pdf', 'passthrough', 'incremental',
+                        'proof', 'skip_broken'):
+                if key in section:
+                    values[key] = section.getboolean(key)
+            for key, choices in SETTING_CHOICES.items():
+                if key in values and values[key] not in choices:
+                    raise ValueError(f"'{values[key]}' is not one of "
+                                     f"{', '.join(choices)}")
+            key = 'trim_size'
+            if section.get('trim_size'):
+                values['page_width'], values['page_height'] = trim_size(
+                    section.get('trim_size'), values.get('bleed_mode', cls.bleed_mode))
+        except ValueError as e:
+            raise BuildError("Error", f"[{section.name}] {key}: {e}")
+        settings = cls(**values)
+        if settings.proof:
+            return proof_settings(settings, values.get('ppi', PROOF_PPI))
+        return settings
+
+
+@dataclass(frozen=True)
+class PageGeometry:
+    # All lengths are in EMU, rounded to whole twips the way python-docx
+    # stores them in the section properties
+    page_width: int
+    page_height: int
+    available_width: int
+    available_height: int
+
+    @property
+    def page_width_pt(self):
+        return self.page_width / EMUS_PER_PT
+
+    @property
+    def page_height_pt(self):
+        return self.page_height / EMUS_PER_PT
+
+
+@dataclass(frozen=True)
+class RenderSpec:
+    # Everything that decides the pixels of a rendered page. It is sent to
+    # the workers and its repr is part of the render cache key.
+    pixel_size: tuple
+    resample: str = 'LANCZOS'
+    quality: str = 'exact'  # One of kdp_resample.QUALITIES
+    backend: str = 'pillow'  # One of kdp_resample.BACKENDS
+    bleed_mode: str = 'Bleed'
+    passthrough: bool = False
+    encoding: str = 'png'  # One of kdp_encode.ENCODINGS
+    jpeg_quality: int = 90
+    png_compress_level: int = 6
+    color: str = 'keep'
+    output_profile: str = ''
+    # The path alone would keep serving pages converted with an older
+    # version of the profile from the cache
+    output_profile_mtime_ns: int = 0
+    color_intent: str = 'perceptual'
+    strip_megapixels: int = STRIP_MEGAPIXELS
+
+
+@dataclass
+class RenderedPage:
+    data: bytes  # Encoded image, the untouched source file, or None when
+                 # the sinks take the page from the previous build
+    passthrough: bool = False
+    stages: dict = field(default_factory=dict)  # Seconds per render stage
+
+
+@dataclass
+class BuildReport:
+    pages: int = 0
+    skipped: list = field(default_factory=list)
+    warnings: list = field(default_factory=list)  # Preflight PageIssues
+    outputs: list = field(default_factory=list)
+    sink_times: dict = field(default_factory=dict)  # Seconds per output type
+    cached: int = 0  # Pages reused from the render cache
+    passed_through: int = 0  # Pages embedded without resampling
+    deduplicated: int = 0  # Pages that reused an image shown earlier
+    reused: int = 0  # Pages copied from the previous incremental build
+    page_bytes: int = 0  # Encoded page images handed to the writers
+    output_bytes: int = 0  # Size of the finished files
+    encode_time: float = 0.0  # Seconds spent encoding, summed over workers
+    stage_times: dict = field(default_factory=dict)  # Seconds per stage
+    peak_rss: int = 0  # Bytes, peak resident memory of the building process
+    elapsed: float = 0.0
+
+
+def trim_size(item, bleed_mode):
+    # Turn a template such as "6 x 9 in" into a page size in inches
+    width, height = item.split(" x ")
+    height = height.replace(" in", "")
+    if bleed_mode == "Bleed":
+        return float(width) + 0.125, float(height) + 0.25
+    return float(width), float(height)
+
+
+def sort_image_files(image_files):
+    image_files = sorted(image_files)
+    try:
+        image_files = sorted(image_files, key=lambda x: float(
+            x.split(' ')[-1].split('.')[0].replace('-', '.')))
+    except:
+        pass
+    return image_files
+
+
+def list_image_files(folder_path):
+    return sort_image_files([f for f in os.listdir(folder_path) if f.lower().endswith(
+        IMAGE_EXTENSIONS)])
+
+
+def proof_settings(settings, ppi=PROOF_PPI):
+    # The proof of a book: same page size, margins, bleed and page order,
+    # so the layout matches the final build, but rendered cheaply at ppi
+    # into '<output>-proof'. The final build stays a separate step.
+    low, high = PROOF_PPI_RANGE
+    output_filename = settings.output_filename
+    if not output_filename.endswith(PROOF_SUFFIX):
+        output_filename += PROOF_SUFFIX
+    return replace(
+        settings,
+        output_filename=output_filename,
+        ppi=min(max(int(ppi), low), high),
+        proof=True,
+        # A PDF proof is all a layout check needs
+        keep_docx=settings.keep_docx and settings.file_type != "PDF",
+        # The streaming writer embeds the JPEG pages without recompressing
+        stream_pdf=True,
+        resample_quality='fast',
+        passthrough=False,
+        encoding='jpeg',
+        jpeg_quality=PROOF_JPEG_QUALITY)
+
+
+def _twips(inches):
+    return int(round(int(inches * 914400) / EMUS_PER_TWIP)) * EMUS_PER_TWIP
+
+
+def page_geometry(settings):
+    page_width = _twips(settings.page_width)
+    page_height = _twips(settings.page_height)
+    if settings.bleed_mode == "Bleed":
+        available_width = page_width
+        available_height = page_height
+    else:
+        gutter = _twips(settings.gutter)
+        available_width = page_width - _twips(settings.left_margin) - \
+            _twips(settings.right_margin) - gutter
+        available_height = page_height - _twips(settings.top_margin) - \
+            _twips(settings.bottom_margin) - gutter
+    return PageGeometry(page_width, page_height, available_width, available_height)
+
+
+def target_pixel_size(page_width_pt, page_height_pt, ppi=TARGET_PPI):
+    return (int(page_width_pt * ppi / 72), int(page_height_pt * ppi / 72))
+
+
+def peak_rss():
+    # Peak resident set size of this process in bytes, 0 when unknown
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD),
+                        ('PageFaultCount', wintypes.DWORD),
+                        ('PeakWorkingSetSize', ctypes.c_size_t),
+                        ('WorkingSetSize', ctypes.c_size_t),
+                        ('QuotaPeakPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaPeakNonPagedPoolUsage', ctypes.c_size_t),
+                        ('QuotaNonPagedPoolUsage', ctypes.c_size_t),
+                        ('PagefileUsage', ctypes.c_size_t),
+                        ('PeakPagefileUsage', ctypes.c_size_t)]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        handle = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(
+                handle, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+        return 0
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def default_workers():
+    return os.cpu_count() or 1
+
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def page_identities(paths):
+    # Pages showing the same image share an identity: the same file, or
+    # different files with identical content. Only files whose size matches
+    # another file's are read and hashed.
+    unique_paths = set(paths)
+    by_size = {}
+    for path in unique_paths:
+        try:
+            by_size.setdefault(os.path.getsize(path), []).append(path)
+        except OSError:
+            pass
+    identity = {path: path for path in unique_paths}
+    for same_size in by_size.values():
+        if len(same_size) > 1:
+            for path in same_size:
+                try:
+                    identity[path] = file_digest(path)
+                except OSError:
+                    pass
+    return [identity[path] for path in paths]
+
+
+def can_pass_through(image, spec):
+    # Sources that already have the page's pixel size and a colour mode both
+    # writers accept are embedded untouched
+    if not spec.passthrough or spec.color != 'keep':
+        return False
+    if image.mode not in PASSTHROUGH_MODES.get(image.format, ()):
+        return False
+    return all(abs(actual - target) <= target * PASSTHROUGH_TOLERANCE
+               for actual, target in zip(image.size, spec.pixel_size))
+
+
+def render_page(file_path, spec):
+    # Decode, resample and encode one page. Runs inside a worker process, so
+    # it only takes and returns plain picklable values: the encoded page
+    # comes back as bytes and never touches the disk, along with the time
+    # spent in each stage. Pages were checked by the preflight, so errors
+    # here are real and are passed back to the caller.
+    started = time.perf_counter()
+    image = Image.open(file_path)
+    # Checked on the source's own size, before draft mode scales it
+    if can_pass_through(image, spec):
+        image.close()
+        with open(file_path, 'rb') as f:
+            return RenderedPage(f.read(), passthrough=True, stages={
+                'decode': time.perf_counter() - started})
+    draft_image(image, spec.pixel_size, spec.quality, spec.strip_megapixels)
+
+    icc_profile = image.info.get('icc_profile')
+    if oversized(image, spec.strip_megapixels):
+        # Decoding and resampling are interleaved band by band, so the time
+        # of both is counted as resampling
+        decoded = time.perf_counter()
+        resized_image = strip_resample(image, spec.pixel_size, spec.resample)
+    else:
+        image.load()
+        decoded = time.perf_counter()
+        resized_image = resample(image, spec.pixel_size, spec.resample,
+                                 spec.quality, spec.backend)
+    image.close()
+    resampled = time.perf_counter()
+    # Colour conversion runs on the page-sized image, after resampling
+    resized_image = convert_color(resized_image, spec.color, spec.output_profile,
+                                  spec.color_intent, icc_profile)
+    converted = time.perf_counter()
+    page_data = encode_page(resized_image, spec.encoding,
+                            spec.jpeg_quality, spec.png_compress_level)
+    stages = {
+        'decode': decoded - started,
+        'resample': resampled - decoded,
+        'encode': time.perf_counter() - converted}
+    if spec.color != 'keep':
+        stages['color'] = converted - resampled
+    return RenderedPage(page_data, stages=stages)
+
+
+def render_task(file_path, spec):
+    # What the workers run. Errors from the page come back as the result,
+    # so an exception from the future itself is the pool's own, such as a
+    # worker killed for running out of memory, and is not blamed on a page.
+    try:
+        return render_page(file_path, spec)
+    except Exception as e:
+        return e
+
+
+def _page_result(item, cache):
+    key, result = item
+    if isinstance(result, RenderedPage):
+        return result  # Came from the cache
+    page = result.result()
+    if isinstance(page, Exception):
+        return page  # Raised by build_book, which knows the file name
+    # Passed through pages are cheaper to read from the source again
+    if cache is not None and key is not None and not page.passthrough:
+        cache.put(key, page.data)
+    return page
+
+
+def render_pages(tasks, workers=None, cache=None, large_paths=()):
+    # Run render_page for every (file_path, spec) task on a process pool and
+    # yield the results in the same order as tasks. Only a small window of
+    # pages is in flight at once, which keeps memory bounded to a handful of
+    # encoded pages while the caller assembles the document. Pages found in
+    # the cache skip the pool entirely. Of the sources in large_paths, at
+    # most LARGE_PAGES_IN_FLIGHT are rendering at any time.
+    workers = workers or default_workers()
+    window = workers * 2
+    # Workers are spawned rather than forked: the GUI starts builds from a
+    # job thread while Tk and the helper threads are running, and forking a
+    # threaded process can leave a worker stuck on a lock held elsewhere
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = deque()
+        large = set()  # Futures of large pages still rendering
+        for file_path, spec in tasks:
+            key = cache.key(file_path, spec) if cache is not None else None
+            page_data = cache.get(key) if key is not None else None
+            if page_data is None:
+                if file_path in large_paths:
+                    while len(large) >= LARGE_PAGES_IN_FLIGHT:
+                        large = wait(large, return_when=FIRST_COMPLETED).not_done
+                future = executor.submit(render_task, file_path, spec)
+                if file_path in large_paths:
+                    large.add(future)
+                pending.append((key, future))
+            else:
+                pending.append((key, RenderedPage(page_data)))
+            if len(pending) >= window:
+                yield _page_result(pending.popleft(), cache)
+        while pending:
+            yield _page_result(pending.popleft(), cache)
+
+
+def build_book(settings, image_files=None, workers=None, cache=None,
+               progress=None, cancel=None):
+    # Render one book from a settings snapshot. Shared by the GUI and the
+    # headless command line, so it must never touch tkinter. progress is an
+    # optional listener for the events described in kdp_progress. cancel is
+    # an optional threading.Event; once set, the build stops before the next
+    # page with BuildCancelled and writes nothing.
+    started = time.perf_counter()
+    folder_path = settings.input_folder
+    if not os.path.exists(folder_path):
+        raise BuildError(
+            "Error", "Selected folder does not exist, please select input folder again.")
+    if image_files is None:
+        image_files = list_image_files(folder_path)
+
+    # Check if there are no images to process
+    if not image_files:
+        raise NoImagesError(
+            "No Images Found", "No image files found in the selected folder.")
+
+    if not backend_available(settings.resample_backend):
+        raise BuildError(
+            "Error", f"The '{settings.resample_backend}' resampling backend is not "
+                     "available, install its dependencies or pick another one.")
+
+    if settings.color != 'keep':
+        try:
+            check_output_profile(settings.output_profile, settings.color)
+        except ValueError as e:
+            raise BuildError("Colour Profile", str(e))
+
+    output_name = settings.output_filename
+    geometry = page_geometry(settings)
+    pixel_size = target_pixel_size(geometry.page_width_pt,
+                                   geometry.page_height_pt, settings.ppi)
+
+    # Read every page's header before any heavy work, so a broken page fails
+    # the build in seconds rather than after everything before it rendered
+    checked = preflight(folder_path, image_files, pixel_size, settings.ppi,
+                        check_resolution=not settings.proof)
+    report = BuildReport(warnings=checked.warnings)
+    if checked.errors:
+        if not settings.skip_broken:
+            raise PreflightError(checked)
+        unusable = {issue.filename for issue in checked.errors}
+        report.skipped = [f for f in image_files if f in unusable]
+        image_files = [f for f in image_files if f not in unusable]
+        if not image_files:
+            raise NoImagesError(
+                "No Images Found", "None of the images in the folder can be used.")
+
+    # The writers pull in python-docx and reportlab, which are slow to
+    # import; the GUI and the render workers never need them otherwise
+    from kdp_sinks import requested_sinks
+
+    target_folder = settings.output_folder or folder_path
+    os.makedirs(target_folder, exist_ok=True)
+    # Only the requested outputs are built
+    sinks = [sink(os.path.join(target_folder, output_name + sink.extension),
+                  settings, geometry)
+             for sink in requested_sinks(settings)]
+
+    spec = RenderSpec(
+        pixel_size=pixel_size,
+        resample=PROOF_FILTER if settings.proof else 'LANCZOS',
+        quality=settings.resample_quality,
+        backend=settings.resample_backend,
+        bleed_mode=settings.bleed_mode,
+        passthrough=settings.passthrough,
+        # PNG cannot hold CMYK, so CMYK pages are always JPEG
+        encoding='jpeg' if settings.color == 'cmyk' else settings.encoding,
+        jpeg_quality=settings.jpeg_quality,
+        png_compress_level=settings.png_compress_level,
+        color=settings.color,
+        output_profile=settings.output_profile,
+        output_profile_mtime_ns=os.stat(settings.output_profile).st_mtime_ns
+        if settings.output_profile and settings.color != 'keep' else 0,
+        color_intent=settings.color_intent,
+        strip_megapixels=settings.strip_megapixels)
+    paths = [os.path.join(folder_path, filename) for filename in image_files]
+    identities = page_identities(paths)
+    uses = Counter(identities)
+    last_use = {identity: index for index, identity in enumerate(identities)}
+    # Every distinct image is rendered once, in order of first appearance
+    first_use = {}
+    for index, identity in enumerate(identities):
+        first_use.setdefault(identity, index)
+    # Incremental builds skip rendering pages that every sink can take
+    # unchanged from the previous build
+    if settings.incremental:
+        sources = [source_key(path, spec) for path in paths]
+    else:
+        sources = [None] * len(paths)
+    reused = {identity for identity, index in first_use.items()
+              if sources[index] is not None
+              and all(sink.reusable(sources[index]) for sink in sinks)}
+    tasks = [(paths[index], spec) for index in sorted(first_use.values())
+             if identities[index] not in reused]
+    cache_hits = cache.hits if cache is not None else 0
+    tracker = BuildProgress(len(image_files), progress)
+    tracker.start()
+
+    # Pages are rendered in parallel but arrive here in list order
+    large_paths = {os.path.join(folder_path, header.filename)
+                   for header in checked.headers.values()
+                   if decoded_whole(header.format, header.mode, header.size,
+                                    spec.strip_megapixels)}
+    results = render_pages(tasks, workers, cache, large_paths)
+    repeated = {}  # Rendered pages that appear again later
+    try:
+        for index, (filename, identity) in enumerate(zip(image_files, identities)):
+            if cancel is not None and cancel.is_set():
+                raise BuildCancelled()
+            if first_use[identity] == index:
+                page = RenderedPage(None) if identity in reused else next(results)
+                fresh = True
+            else:
+                page = repeated[identity]
+                fresh = False
+            if uses[identity] > 1:
+                if last_use[identity] == index:
+                    repeated.pop(identity, None)
+                else:
+                    repeated[identity] = page
+            if isinstance(page, Exception):
+                if not settings.skip_broken:
+                    raise BuildError(
+                        "Page Could Not Be Rendered", f"{filename}: {page}") from page
+                report.skipped.append(filename)
+                tracker.page(filename, {}, skipped=True)
+                continue
+
+            # Repeated images are embedded once and shared between pages
+            key = identity if uses[identity] > 1 else None
+            stages = dict(page.stages) if fresh else {}
+            for sink in sinks:
+                stages[sink.stage] = sink.add_page(page.data, key, sources[index])
+            tracker.page(filename, stages)
+            report.pages += 1
+            if not fresh:
+                report.deduplicated += 1
+                continue
+            if page.data is None:
+                report.reused += 1
+                continue
+            report.page_bytes += len(page.data)
+            report.encode_time += page.stages.get('encode', 0.0)
+            if page.passthrough:
+                report.passed_through += 1
+    except BaseException:
+        results.close()  # Lets pages still in flight finish and the pool exit
+        for sink in sinks:
+            sink.abort()
+        raise
+
+    # Save the outputs only if there are images added
+    for sink in sinks:
+        if report.pages:
+            sink.finish()
+            report.outputs.append(sink.path)
+            report.output_bytes += os.path.getsize(sink.path)
+        else:
+            sink.abort()
+    report.sink_times = {sink.name: sink.elapsed for sink in sinks}
+    if cache is not None:
+        report.cached = cache.hits - cache_hits
+    report.stage_times = dict(tracker.stage_totals, preflight=checked.elapsed)
+    tracker.finish(report.pages, len(report.skipped))
+
+    report.peak_rss = peak_rss()
+    report.elapsed = time.perf_counter() - started
+    return report
@@ -0,0 +1,289 @@
+from PIL import Image
+
+np = None  # NumPy, imported the first time the 'numpy' backend is used
+
+# How pages are scaled to their target pixel size.
+#
+# "exact" runs the chosen filter over the fully decoded source, which is
+# what the tool has always done. "fast" lets the JPEG decoder scale down by
+# 1/2, 1/4 or 1/8 while decoding (draft mode, never below the target size),
+# then shrinks by whole factors with Image.reduce, and only runs the filter
+# on the last step. On 6000 x 8000 JPEGs this is about three times faster
+# and differs from "exact" by about one level per channel on average.
+QUALITIES = ('exact', 'fast')
+
+# Image.reduce stops once the image is this many times the target size,
+# leaving the rest to the final filter
+REDUCING_GAP = 2.0
+
+
+def draft_image(image, size, quality='exact', strip_megapixels=0):
+    # Sets up JPEG scaling while decoding. Afterwards image.size is the
+    # scaled size, so anything that needs the source's own size must look
+    # before this is called.
+    if image.format == 'JPEG':
+        if quality == 'fast':
+            image.draft(image.mode, size)
+        elif oversized(image, strip_megapixels):
+            # The JPEG decoder cannot stop between bands of rows, so an
+            # oversized one is scaled while decoding instead, keeping at
+            # least REDUCING_GAP times the target size for the filter
+            image.draft(image.mode, (int(size[0] * REDUCING_GAP),
+                                     int(size[1] * REDUCING_GAP)))
+
+
+# Sources above a pixel threshold (strip_megapixels, 0 for never) are
+# resampled a band of output rows at a time. Each band runs the filter over
+# just the source rows it needs plus the filter's support, and is pasted
+# into the page-sized output, so the filter's working memory no longer
+# grows with the source. Uncompressed sources (BMP, PPM, plain TIFF) are
+# also decoded band by band, straight from the file, and JPEGs are scaled
+# down while decoding; other formats (PNG, compressed TIFF) are decoded
+# whole first, since Pillow's decoders cannot pause between bands, so the
+# build renders those one at a time (see decoded_whole).
+STRIP_MEGAPIXELS = 100
+STRIP_MODES = ('L', 'RGB', 'RGBA', 'CMYK')
+STRIP_BAND_PIXELS = 4 * 1024 * 1024  # Source pixels per band
+
+# Half width of each filter's window at scale 1, as Pillow defines them
+FILTER_SUPPORT = {'NEAREST': 0.5, 'BOX': 0.5, 'BILINEAR': 1.0, 'HAMMING': 1.0,
+                  'BICUBIC': 2.0, 'LANCZOS': 3.0}
+
+
+def oversized(image, strip_megapixels):
+    return oversized_source(image.mode, image.size, strip_megapixels)
+
+
+def oversized_source(mode, size, strip_megapixels):
+    return bool(strip_megapixels) and mode in STRIP_MODES \
+        and size[0] * size[1] > strip_megapixels * 1000 * 1000
+
+
+def decoded_whole(image_format, mode, size, strip_megapixels):
+    # Oversized sources whose decoder holds the whole image in memory at
+    # once, however it is resampled afterwards. Plain TIFFs are read band by
+    # band, but telling them from compressed ones takes more than the
+    # header, so every TIFF counts.
+    return oversized_source(mode, size, strip_megapixels) \
+        and image_format not in ('JPEG', 'BMP', 'PPM')
+
+
+def _row_bytes(mode, rawmode, width):
+    try:
+        return len(Image.new(mode, (width, 1)).tobytes('raw', rawmode))
+    except ValueError:
+        return None
+
+
+def _raw_strips(image):
+    # (top, bottom, offset, rawmode, stride, ystep) for each tile of a not
+    # yet loaded, uncompressed source, or None if it cannot be read in bands
+    if getattr(image, 'fp', None) is None or not image.tile:
+        return None
+    strips = []
+    for tile in image.tile:
+        codec, (x0, top, x1, bottom), offset, args = tuple(tile)[:4]
+        if codec != 'raw' or x0 != 0 or x1 != image.width:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, ystep = (tuple(args) + (0, 1))[:3]
+        stride = stride or _row_bytes(image.mode, rawmode, image.width)
+        if not stride or ystep not in (1, -1):
+            return None
+        strips.append((top, bottom, offset, rawmode, stride, ystep))
+    return strips
+
+
+def _read_rows(image, strips, top, bottom):
+    # Decode source rows top to bottom into a band of their own
+    pieces = []
+    for strip_top, strip_bottom, offset, rawmode, stride, ystep in strips:
+        first, last = max(top, strip_top), min(bottom, strip_bottom)
+        if first >= last:
+            continue
+        # Bottom-up strips (BMP) store their last row first
+        row = first - strip_top if ystep == 1 else strip_bottom - last
+        image.fp.seek(offset + row * stride)
+        data = image.fp.read((last - first) * stride)
+        pieces.append((first - top, Image.frombytes(
+            image.mode, (image.width, last - first), data, 'raw', rawmode,
+            stride, ystep)))
+    if len(pieces) == 1:
+        return pieces[0][1]
+    band = Image.new(image.mode, (image.width, bottom - top))
+    for y, piece in pieces:
+        band.paste(piece, (0, y))
+    return band
+
+
+def strip_resample(image, size, filter_name='LANCZOS'):
+    # Always Pillow's filter, whatever the backend: the band is given as a
+    # box, and Pillow reads the support rows around it from the band
+    resample_filter = getattr(Image, filter_name)
+    width, height = size
+    scale = image.height / height
+    support = FILTER_SUPPORT[filter_name] * max(scale, 1.0)
+    strips = _raw_strips(image)
+    if strips is None:
+        image.load()
+    source_rows = max(1, STRIP_BAND_PIXELS // image.width)
+    rows = max(1, int((source_rows - 2 * support - 4) / scale))
+    out = Image.new(image.mode, size)
+    for top in range(0, height, rows):
+        bottom = min(height, top + rows)
+        first = max(0, int(top * scale - support) - 1)
+        last = min(image.height, int(bottom * scale + support) + 2)
+        if strips is None:
+            band, first = image, 0  # Already decoded, filter it in place
+        else:
+            band = _read_rows(image, strips, first, last)
+        out.paste(band.resize((width, bottom - top), resample_filter,
+                              box=(0, top * scale - first, image.width,
+                                   bottom * scale - first)), (0, top))
+    return out
+
+
+def pillow_resample(image, size, filter_name='LANCZOS', quality='exact'):
+    # Also the pillow-simd path: it installs as a drop-in replacement for
+    # Pillow and speeds up this same call
+    resample_filter = getattr(Image, filter_name)
+    if quality == 'fast':
+        # Image.resize with a reducing gap applies Image.reduce by the
+        # largest whole factor first, then the filter on what is left
+        return image.resize(size, resample_filter, reducing_gap=REDUCING_GAP)
+    return image.resize(size, resample_filter)
+
+
+# The NumPy backend runs the separable Lanczos filter as matrix products.
+# The weights of each block of NUMPY_BLOCK output pixels form a small dense
+# matrix over the source pixels that block reads, built once per page size,
+# so every pass is a series of BLAS matmuls. The source is read in bands of
+# rows and the 8-bit intermediate is the only full-height array, so memory
+# stays near the decoded source plus one uint8 copy at the target width
+# (about 100 MB next to an 8000 x 12000 source). Output matches Pillow to
+# within one level. On one core it takes 1.3 to 1.6 times as long as
+# Pillow's C filter, which stays the default; a NumPy built on a
+# multi-threaded BLAS can catch up when fewer pages render than there are
+# cores. Other filters and modes go to Pillow.
+NUMPY_FILTERS = {'LANCZOS': 3.0}
+NUMPY_MODES = ('L', 'RGB', 'CMYK')
+NUMPY_BLOCK = 32  # Output pixels per weight matrix
+BAND_PIXELS = 4 * 1024 * 1024
+
+
+def _lanczos(x, a):
+    x = np.abs(x)
+    return np.where(x < a, np.sinc(x) * np.sinc(x / a), 0.0)
+
+
+def _filter_weights(in_size, out_size, a):
+    # Per output pixel, the source indices and normalised weights of its
+    # taps, placed the way Pillow places them
+    scale = in_size / out_size
+    filter_scale = max(scale, 1.0)
+    support = a * filter_scale
+    taps = int(np.ceil(support)) * 2 + 1
+    centers = (np.arange(out_size) + 0.5) * scale
+    first = np.maximum((centers - support + 0.5).astype(np.int64), 0)
+    last = np.minimum((centers + support + 0.5).astype(np.int64), in_size)
+    indices = first[:, None] + np.arange(taps)[None, :]
+    weights = _lanczos((indices - centers[:, None] + 0.5) / filter_scale, a)
+    weights[indices >= last[:, None]] = 0.0
+    weights /= weights.sum(axis=1, keepdims=True)
+    return np.minimum(indices, in_size - 1), weights.astype(np.float32)
+
+
+def _weight_blocks(in_size, out_size, a):
+    # (out start, out end, source start, source end, matrix) per block of
+    # output pixels; matrix[s, o] is the weight of source pixel s in output o
+    indices, weights = _filter_weights(in_size, out_size, a)
+    blocks = []
+    for start in range(0, out_size, NUMPY_BLOCK):
+        end = min(out_size, start + NUMPY_BLOCK)
+        block_indices = indices[start:end]
+        first, last = int(block_indices.min()), int(block_indices.max()) + 1
+        matrix = np.zeros((last - first, end - start), np.float32)
+        columns = np.broadcast_to(np.arange(end - start)[:, None], block_indices.shape)
+        # Clamped taps at the edges land on the same source pixel, so add
+        np.add.at(matrix, (block_indices - first, columns), weights[start:end])
+        blocks.append((start, end, first, last, matrix))
+    return blocks
+
+
+def _to_uint8(array):
+    # Round and clip in place, the way Pillow stores each pass
+    np.rint(array, out=array)
+    np.clip(array, 0, 255, out=array)
+    return array.astype(np.uint8)
+
+
+def _import_numpy():
+    # NumPy is slow to import, so only builds that pick this backend pay
+    # for it
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+def numpy_resample(image, size, filter_name='LANCZOS', quality='exact'):
+    if filter_name not in NUMPY_FILTERS or image.mode not in NUMPY_MODES:
+        return pillow_resample(image, size, filter_name, quality)
+    _import_numpy()
+    if quality == 'fast':
+        factor = int(min(image.width / size[0], image.height / size[1]) / REDUCING_GAP)
+        if factor > 1:
+            image = image.reduce(factor)
+    a = NUMPY_FILTERS[filter_name]
+    width, height = size
+    channels = len(image.getbands())
+
+    # Horizontal pass over bands of rows, channel planes side by side so
+    # each block is one matmul. Pillow keeps 8 bits between the passes;
+    # doing the same keeps ringing around hard edges identical.
+    x_blocks = _weight_blocks(image.width, width, a)
+    rows = max(1, BAND_PIXELS // (image.width * channels))
+    wide = np.empty((image.height, width, channels), np.uint8)
+    for top in range(0, image.height, rows):
+        band = np.asarray(image.crop((0, top, image.width,
+                                      min(image.height, top + rows))))
+        count = band.shape[0]
+        planes = band.reshape(count, image.width, channels).transpose(0, 2, 1)
+        planes = planes.reshape(count * channels, image.width).astype(np.float32)
+        filtered = np.empty((count * channels, width), np.float32)
+        for start, end, first, last, matrix in x_blocks:
+            np.matmul(planes[:, first:last], matrix, out=filtered[:, start:end])
+        wide[top:top + count] = _to_uint8(filtered).reshape(
+            count, channels, width).transpose(0, 2, 1)
+
+    # Vertical pass, one block of output rows at a time over all columns
+    wide = wide.reshape(image.height, width * channels)
+    out = np.empty((height, width * channels), np.uint8)
+    for start, end, first, last, matrix in _weight_blocks(image.height, height, a):
+        out[start:end] = _to_uint8(matrix.T @ wide[first:last].astype(np.float32))
+    out = out.reshape(height, width, channels)
+    return Image.fromarray(out if channels > 1 else out[:, :, 0], image.mode)
+
+
+# Resampling backends by name; every one takes the same arguments
+BACKENDS = {
+    'pillow': pillow_resample,
+    'numpy': numpy_resample,
+}
+
+
+def backend_available(name):
+    if name == 'numpy':
+        try:
+            _import_numpy()
+        except ImportError:
+            return False
+        return True
+    return name in BACKENDS
+
+
+def resample(image, size, filter_name='LANCZOS', quality='exact',
+             backend='pillow'):
+    return BACKENDS[backend](image, size, filter_name, quality)
@@ -0,0 +1,72 @@
+# The ordered list of pages in a book. Every edit is reported to listeners
+# as a small diff, so a view only touches the rows that actually changed
+# instead of redrawing the whole list.
+#
+# Listeners are called as listener(op, *args) with one of:
+#   ('reset', items)          the whole list was replaced
+#   ('insert', index, items)  items were inserted before index
+#   ('delete', index)         the row at index was removed
+#   ('replace', index, item)  the row at index now shows item
+
+
+class PageSequence:
+    def __init__(self, items=()):
+        self._items = list(items)
+        self._listeners = []
+
+    @property
+    def items(self):
+        # The live list; change it only through the methods below
+        return self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __getitem__(self, index):
+        return self._items[index]
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def subscribe(self, listener):
+        self._listeners.append(listener)
+
+    def _notify(self, op, *args):
+        for listener in self._listeners:
+            listener(op, *args)
+
+    def reset(self, items):
+        self._items = list(items)
+        self._notify('reset', self._items)
+
+    def insert(self, index, items):
+        items = list(items)
+        self._items[index:index] = items
+        self._notify('insert', index, items)
+
+    def delete(self, indices):
+        # Returns [(item, index)] in the order the rows were removed, from
+        # the bottom up
+        removed = []
+        for index in sorted(indices, reverse=True):
+            removed.append((self._items.pop(index), index))
+            self._notify('delete', index)
+        return removed
+
+    def swap(self, i, j):
+        self._items[i], self._items[j] = self._items[j], self._items[i]
+        self._notify('replace', i, self._items[i])
+        self._notify('replace', j, self._items[j])
+
+    def move(self, indices, target):
+        # Take the rows at indices out and insert them as a block at target,
+        # counted after the removal
+        items = [self._items[i] for i in indices]
+        self.delete(indices)
+        self.insert(target, items)
+
+    def duplicate(self, indices):
+        # Insert a copy of each row right after it, last row first so the
+        # inserts do not shift the rows still to copy
+        for index in sorted(indices, reverse=True):
+            self.insert(index + 1, [self._items[index]])
@@ -0,0 +1,208 @@
+import struct
+import time
+from io import BytesIO
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.shared import Emu, Inches
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from kdp_manifest import PreviousOutput, remove_manifest, save_manifest
+from kdp_pdf import StreamingPdfWriter
+
+# Output writers. build_book opens only the sinks the settings ask for and
+# feeds every rendered page to each of them in order.
+
+
+class PageSink:
+    name = ''
+    extension = ''
+    stage = ''  # Name of this sink's stage in progress events
+
+    def __init__(self, path, settings, geometry):
+        self.path = path
+        self.settings = settings
+        self.geometry = geometry
+        self.elapsed = 0.0  # Seconds spent in this sink
+
+    def add_page(self, page_data, key=None, source=None):
+        # key is set for images that appear on more than one page, so the
+        # sink can embed them once. source is the page's fingerprint for
+        # incremental builds; page_data is None when reusable(source) said
+        # the page can be taken from the previous build. Returns the seconds
+        # spent on this page.
+        started = time.perf_counter()
+        self.write_page(page_data, key, source)
+        elapsed = time.perf_counter() - started
+        self.elapsed += elapsed
+        return elapsed
+
+    def finish(self):
+        started = time.perf_counter()
+        self.save()
+        self.elapsed += time.perf_counter() - started
+
+    def reusable(self, source):
+        # Whether this sink can place the page without its image data
+        return False
+
+    def write_page(self, page_data, key, source):
+        raise NotImplementedError
+
+    def save(self):
+        raise NotImplementedError
+
+    def abort(self):
+        # Called instead of finish when the build produced nothing
+        pass
+
+
+class PdfSink(PageSink):
+    name = 'PDF'
+    extension = '.pdf'
+    stage = 'pdf_draw'
+
+    def __init__(self, path, settings, geometry):
+        super().__init__(path, settings, geometry)
+        self.pdf_canvas = canvas.Canvas(
+            path, pagesize=(geometry.page_width_pt, geometry.page_height_pt))
+        self.forms = {}  # Shared images by key, as form XObjects
+
+    def _draw(self, page_data):
+        self.pdf_canvas.drawImage(ImageReader(BytesIO(page_data)), 0, 0, width=int(
+            self.geometry.page_width_pt), height=int(self.geometry.page_height_pt))
+
+    def write_page(self, page_data, key, source):
+        if key is None:
+            self._draw(page_data)
+        else:
+            if key not in self.forms:
+                self.forms[key] = f'Page{len(self.forms)}'
+                self.pdf_canvas.beginForm(self.forms[key])
+                self._draw(page_data)
+                self.pdf_canvas.endForm()
+            self.pdf_canvas.doForm(self.forms[key])
+        self.pdf_canvas.showPage()
+
+    def save(self):
+        self.pdf_canvas.save()
+        remove_manifest(self.path)  # Describes a PDF that is now gone
+
+
+class StreamingPdfSink(PageSink):
+    # Flushes every page to disk as it arrives instead of keeping the whole
+    # book in memory until the end
+    name = 'PDF'
+    extension = '.pdf'
+    stage = 'pdf_draw'
+
+    def __init__(self, path, settings, geometry):
+        super().__init__(path, settings, geometry)
+        self.writer = StreamingPdfWriter(
+            path, geometry.page_width_pt, geometry.page_height_pt)
+        self.images = {}  # Object ids of shared images by key
+        # Image objects of the last incremental build of this file
+        self.previous = PreviousOutput(path) if settings.incremental else None
+        self.manifest_pages = []  # (source, span) per page
+
+    def reusable(self, source):
+        return self.previous is not None and source in self.previous
+
+    def write_page(self, page_data, key, source):
+        image_id = self.images.get(key) if key is not None else None
+        if image_id is None:
+            if page_data is None:
+                image_id = self.writer.add_image_object(self.previous.read(source))
+            else:
+                image_id = self.writer.add_image(page_data)
+            if key is not None:
+                self.images[key] = image_id
+        if source is not None:
+            self.manifest_pages.append((source, self.writer.spans[image_id]))
+        self.writer.add_page(image_id, int(self.geometry.page_width_pt),
+                             int(self.geometry.page_height_pt))
+
+    def save(self):
+        if self.previous is not None:
+            self.previous.close()
+        self.writer.close()
+        if self.settings.incremental:
+            save_manifest(self.path, self.manifest_pages, self.settings)
+        else:
+            remove_manifest(self.path)
+
+    def abort(self):
+        if self.previous is not None:
+            self.previous.close()
+        self.writer.abort()
+
+
+# python-docx only recognises JPEGs that open with a JFIF or Exif segment.
+# CMYK JPEGs open with Adobe's segment instead, so an empty Exif segment is
+# put in front of it for the DOCX; any JPEG reader skips it.
+EMPTY_EXIF = b'Exif\x00\x00MM\x00*\x00\x00\x00\x08\x00\x00\x00\x00\x00\x00'
+
+
+def docx_picture(page_data):
+    if page_data[:2] == b'\xff\xd8' and page_data[6:10] not in (b'JFIF', b'Exif'):
+        segment = b'\xff\xe1' + struct.pack('>H', len(EMPTY_EXIF) + 2) + EMPTY_EXIF
+        page_data = page_data[:2] + segment + page_data[2:]
+    return BytesIO(page_data)
+
+
+class DocxSink(PageSink):
+    name = 'DOCX'
+    extension = '.docx'
+    stage = 'docx_add'
+
+    def __init__(self, path, settings, geometry):
+        super().__init__(path, settings, geometry)
+        self.doc = Document()
+        section = self.doc.sections[0]
+        sectPr = section._sectPr
+
+        # Create the mirrorMargins element
+        mirror_margins = OxmlElement('w:mirrorMargins')
+        sectPr.append(mirror_margins)
+        section.page_width = Inches(settings.page_width)
+        section.page_height = Inches(settings.page_height)
+        if settings.bleed_mode == "Bleed":
+            section.top_margin = Inches(0)
+            section.bottom_margin = Inches(0)
+            section.left_margin = Inches(0)
+            section.right_margin = Inches(0)
+            section.gutter = Inches(0)
+        else:
+            section.top_margin = Inches(settings.top_margin)
+            section.bottom_margin = Inches(settings.bottom_margin)
+            section.left_margin = Inches(settings.left_margin)
+            section.right_margin = Inches(settings.right_margin)
+            section.gutter = Inches(settings.gutter)
+
+    def write_page(self, page_data, key, source):
+        # python-docx already stores identical pictures as one media part
+        self.doc.add_picture(docx_picture(page_data),
+                             width=Emu(self.geometry.available_width),
+                             height=Emu(self.geometry.available_height))
+
+    def save(self):
+        self.doc.save(self.path)
+
+
+# Output types by name, so new formats can be plugged in here
+SINKS = {
+    'PDF': PdfSink,
+    'DOCX': DocxSink,
+}
+
+
+def requested_sinks(settings):
+    # A PDF build used to write a DOCX as well and then delete it; now the
+    # DOCX is only produced when it is going to be kept
+    names = [settings.file_type]
+    if settings.file_type == "PDF" and settings.keep_docx:
+        names.append("DOCX")
+    sinks = [SINKS[name] for name in names]
+    if settings.stream_pdf or settings.incremental:
+        # Incremental builds copy pages out of the previous streamed PDF
+        sinks = [StreamingPdfSink if sink is PdfSink else sink for sink in sinks]
+    return sinks
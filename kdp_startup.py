@@ -0,0 +1,64 @@
+import json
+import sys
+import time
+
+# Startup timing for the GUI. The clock starts when the script starts,
+# before its heavy imports, and each step of getting the window up is
+# marked on the way:
+#
+#   imports  every module the window needs is loaded
+#   window   all widgets are built
+#   paint    the main loop is running and the window is on screen
+#   folder   the page list of the last folder is filled in
+#
+# Run the app with --startup-report [PATH] to append the timings to PATH
+# as one JSON line (stderr without a PATH) and quit once the folder is
+# loaded. The exit status is 1 when the window took longer than
+# STARTUP_TARGET seconds to paint, so cold starts of the frozen build can
+# be checked from a script.
+
+STARTUP_TARGET = 1.5  # Seconds from launch to a painted window
+
+# Modules that should only load once a build starts
+DEFERRED_MODULES = ('docx', 'reportlab', 'numpy', 'PIL.ImageCms')
+
+
+class StartupTimer:
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.marks = {}  # step -> seconds since started
+
+    def mark(self, step):
+        # Only the first time a step is reached counts
+        self.marks.setdefault(step, time.perf_counter() - self.started)
+
+    def within_target(self, target=STARTUP_TARGET):
+        return self.marks.get('paint', float('inf')) <= target
+
+    def report(self, target=STARTUP_TARGET):
+        return {
+            'marks': {step: round(seconds, 3) for step, seconds in self.marks.items()},
+            'target': target,
+            'within_target': self.within_target(target),
+            # Any of these showing up means an import crept back into startup
+            'loaded_early': [name for name in DEFERRED_MODULES if name in sys.modules],
+            'frozen': bool(getattr(sys, 'frozen', False)),
+        }
+
+    def write(self, path=None, target=STARTUP_TARGET):
+        line = json.dumps(self.report(target))
+        if path:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
+        elif sys.stderr is not None:  # None in a frozen build without console
+            print(line, file=sys.stderr)
+
+
+def startup_report_option(argv):
+    # (wanted, path) for --startup-report [PATH] on the command line
+    if '--startup-report' not in argv:
+        return False, None
+    index = argv.index('--startup-report') + 1
+    if index < len(argv) and not argv[index].startswith('--'):
+        return True, argv[index]
+    return True, None
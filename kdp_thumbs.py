@@ -0,0 +1,106 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict, deque
+from PIL import Image
+from kdp_cache import cache_entries, evict_lru
+
+# Preview thumbnails. Decoding happens on a background thread so the Tk
+# main loop never waits on a multi-megapixel image; finished thumbnails are
+# kept in an LRU in memory and, optionally, on disk keyed by the source's
+# modification time. Every edit of a page leaves its old thumbnail behind,
+# so the disk store is capped like the render cache and evicted in LRU
+# order.
+
+THUMBNAIL_SIZE = (200, 200)
+DEFAULT_STORE_BYTES = 128 * 1024 ** 2
+
+
+class ThumbnailCache:
+    def __init__(self, on_ready, capacity=256, directory=None,
+                 max_store_bytes=DEFAULT_STORE_BYTES):
+        # on_ready(path, image) is called on the loader thread
+        self.on_ready = on_ready
+        self.capacity = capacity
+        self.directory = directory
+        self.max_store_bytes = max_store_bytes
+        self._store_bytes = None  # Measured on the first write
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._memory = OrderedDict()  # path -> (mtime_ns, image)
+        self._queue = deque()
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def get(self, path):
+        # Never blocks; returns None when the thumbnail is not loaded yet
+        with self._condition:
+            entry = self._memory.get(path)
+            if entry is None:
+                return None
+            self._memory.move_to_end(path)
+            return entry[1]
+
+    def request(self, paths):
+        # Load paths in order, the first being the one shown right now and
+        # the rest neighbours worth having ready. Replaces earlier requests
+        # that have not started yet, so fast scrolling never builds a
+        # backlog.
+        with self._condition:
+            self._queue = deque(path for path in paths if path not in self._memory)
+            self._condition.notify()
+
+    def invalidate(self, path):
+        with self._condition:
+            self._memory.pop(path, None)
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while not self._queue:
+                    self._condition.wait()
+                path = self._queue.popleft()
+            try:
+                mtime_ns = os.stat(path).st_mtime_ns
+                image = self._load(path, mtime_ns)
+            except Exception:
+                continue  # Unreadable files simply get no preview
+            with self._condition:
+                self._memory[path] = (mtime_ns, image)
+                self._memory.move_to_end(path)
+                while len(self._memory) > self.capacity:
+                    self._memory.popitem(last=False)
+            self.on_ready(path, image)
+
+    def _store_path(self, path, mtime_ns):
+        key = hashlib.sha1(f"{os.path.abspath(path)}|{mtime_ns}".encode('utf-8'))
+        return os.path.join(self.directory, key.hexdigest() + '.png')
+
+    def _load(self, path, mtime_ns):
+        store_path = self._store_path(path, mtime_ns) if self.directory else None
+        if store_path and os.path.exists(store_path):
+            image = Image.open(store_path)
+            image.load()
+            os.utime(store_path)  # Mark as recently used for eviction
+            return image
+
+        image = Image.open(path)
+        image.draft('RGB', THUMBNAIL_SIZE)  # JPEGs decode at a fraction of their size
+        image.thumbnail(THUMBNAIL_SIZE)
+        if store_path:
+            try:
+                image.save(store_path, format='PNG')
+                self._stored(os.path.getsize(store_path))
+            except (OSError, ValueError):
+                pass
+        return image
+
+    def _stored(self, size):
+        # Only the loader thread writes to the store
+        if self._store_bytes is None:
+            self._store_bytes = sum(size for _, size, _ in cache_entries(self.directory))
+        else:
+            self._store_bytes += size
+        if self._store_bytes > self.max_store_bytes:
+            self._store_bytes = evict_lru(self.directory, self.max_store_bytes)
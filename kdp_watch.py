@@ -0,0 +1,192 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import stat
+import struct
+import sys
+import threading
+import time
+from kdp_index import scan_folder
+from kdp_render import IMAGE_EXTENSIONS
+
+# Watches an image folder and reports pages that were added, changed or
+# removed, so the page list and caches can follow along while pages are
+# still being drawn. Linux uses inotify, so only the files named in events
+# are looked at; everywhere else the folder is polled with one scandir pass
+# per interval.
+#
+# A file is only reported once its size and modification time have held
+# still for half an interval, so a page that is still being saved (or
+# copied over a slow share) is not picked up half written.
+
+POLL_INTERVAL = 1.0
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+def _inotify_libc():
+    # libc with inotify support, or None where it is not available
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                           use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class FolderWatcher:
+    def __init__(self, folder_path, on_change, interval=POLL_INTERVAL,
+                 use_inotify=True):
+        # on_change(added, modified, removed) is called on the watcher thread
+        # with sorted lists of file names
+        self.folder_path = folder_path
+        self.on_change = on_change
+        self.interval = interval
+        self.use_inotify = use_inotify
+        self.backend = None
+        self._known = {}  # name -> (size, mtime_ns) as last reported
+        self._unsettled = {}  # name -> ((size, mtime_ns), first seen)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, known=None):
+        # known is the folder as the caller last listed it, name ->
+        # ImageEntry; without it the folder is scanned on the watcher thread
+        fd = self._open_inotify() if self.use_inotify else None
+        self.backend = 'inotify' if fd is not None else 'poll'
+        self._thread = threading.Thread(target=self._run, args=(fd, known),
+                                        daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self, fd, known):
+        if known is None:
+            try:
+                known = scan_folder(self.folder_path)
+            except OSError:
+                known = {}
+        self._known = {name: (entry.size, entry.mtime_ns)
+                       for name, entry in known.items()}
+        if fd is not None:
+            self._watch_inotify(fd)
+        else:
+            self._watch_poll()
+
+    def stop(self):
+        # Returns at once; the thread notices within one interval and no
+        # further changes are reported after this call
+        self._stop.set()
+
+    def _open_inotify(self):
+        libc = _inotify_libc()
+        if libc is None:
+            return None
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            return None
+        if libc.inotify_add_watch(fd, os.fsencode(self.folder_path), WATCH_MASK) < 0:
+            os.close(fd)  # e.g. out of watches, or a network share
+            return None
+        return fd
+
+    def _watch_inotify(self, fd):
+        try:
+            while not self._stop.is_set():
+                ready, _, _ = select.select([fd], [], [], self.interval / 2)
+                if not ready:
+                    self._check(())
+                    continue
+                try:
+                    buffer = os.read(fd, 64 * 1024)
+                except BlockingIOError:
+                    continue
+                names = set()
+                rescan = False
+                offset = 0
+                while offset < len(buffer):
+                    wd, mask, cookie, length = EVENT_HEADER.unpack_from(buffer, offset)
+                    offset += EVENT_HEADER.size
+                    name = buffer[offset:offset + length].rstrip(b'\0')
+                    offset += length
+                    if mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        return  # The folder itself is gone
+                    if mask & IN_Q_OVERFLOW:
+                        rescan = True
+                    elif name:
+                        name = os.fsdecode(name)
+                        if name.lower().endswith(IMAGE_EXTENSIONS):
+                            names.add(name)
+                self._check(None if rescan else names)
+        finally:
+            os.close(fd)
+
+    def _watch_poll(self):
+        while not self._stop.wait(self.interval):
+            self._check(None)
+
+    def _check(self, names):
+        # names are the files worth looking at, or None for all of them.
+        # Files still settling are always looked at again.
+        if names is None:
+            try:
+                current = {name: (entry.size, entry.mtime_ns)
+                           for name, entry in scan_folder(self.folder_path).items()}
+            except OSError:
+                return
+            names = set(current) | set(self._known) | set(self._unsettled)
+        else:
+            names = set(names) | set(self._unsettled)
+            current = {}
+            for name in names:
+                self._stat_into(current, name)
+
+        now = time.monotonic()
+        added, modified, removed = [], [], []
+        for name in names:
+            state = current.get(name)
+            if state is None:
+                self._unsettled.pop(name, None)
+                if self._known.pop(name, None) is not None:
+                    removed.append(name)
+                continue
+            if self._known.get(name) == state:
+                self._unsettled.pop(name, None)
+                continue
+            seen = self._unsettled.get(name)
+            if seen is None or seen[0] != state:
+                self._unsettled[name] = (state, now)  # Check again later
+                continue
+            if now - seen[1] < self.interval / 2:
+                continue
+            del self._unsettled[name]
+            (modified if name in self._known else added).append(name)
+            self._known[name] = state
+
+        if (added or modified or removed) and not self._stop.is_set():
+            self.on_change(sorted(added), sorted(modified), sorted(removed))
+
+    def _stat_into(self, current, name):
+        try:
+            st = os.stat(os.path.join(self.folder_path, name))
+        except OSError:
+            return
+        if stat.S_ISREG(st.st_mode):
+            current[name] = (st.st_size, st.st_mtime_ns)
@@ -0,0 +1,116 @@
+import os
+import re
+
+import pytest
+from PIL import Image
+
+from kdp_manifest import PreviousOutput, manifest_path
+from kdp_render import BookSettings, build_book
+
+pypdf = pytest.importorskip('pypdf')
+
+COLORS = {
+    'a.png': (200, 30, 30),
+    'b.png': (30, 200, 30),
+    'c.png': (30, 30, 200),
+    'd.png': (200, 200, 30),
+}
+
+
+def make_pages(folder, colors):
+    for filename, color in colors.items():
+        Image.new('RGB', (120, 180), color).save(os.path.join(folder, filename))
+
+
+def build(folder, output_folder):
+    settings = BookSettings(str(folder), file_type='PDF', keep_docx=False,
+                            output_folder=str(output_folder), page_width=1.0,
+                            page_height=1.5, ppi=72, incremental=True)
+    return build_book(settings, workers=1)
+
+
+def page_colors(path):
+    reader = pypdf.PdfReader(path, strict=True)
+    colors = []
+    for page in reader.pages:
+        image = page.images[0].image.convert('RGB')
+        colors.append(image.getpixel((image.width // 2, image.height // 2)))
+    return colors
+
+
+def close_to(actual, expected):
+    return all(abs(a - e) <= 2 for a, e in zip(actual, expected))
+
+
+def test_incremental_rebuild_keeps_page_count_and_order(tmp_path):
+    folder, output = tmp_path / 'pages', tmp_path / 'out'
+    folder.mkdir()
+    make_pages(folder, COLORS)
+    report = build(folder, output)
+    assert report.pages == 4 and report.reused == 0
+    pdf_path = str(output / 'Output.pdf')
+    colors = page_colors(pdf_path)
+    assert all(close_to(actual, expected)
+               for actual, expected in zip(colors, COLORS.values()))
+
+    # Edit one page; the other three come out of the previous PDF
+    edited = dict(COLORS, **{'c.png': (250, 250, 250)})
+    make_pages(folder, {'c.png': edited['c.png']})
+    stat = os.stat(folder / 'c.png')
+    os.utime(folder / 'c.png', ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    report = build(folder, output)
+    assert report.pages == 4 and report.reused == 3
+    colors = page_colors(pdf_path)
+    assert len(colors) == 4
+    assert all(close_to(actual, expected)
+               for actual, expected in zip(colors, edited.values()))
+
+
+def test_xref_entries_are_20_bytes(tmp_path):
+    folder, output = tmp_path / 'pages', tmp_path / 'out'
+    folder.mkdir()
+    make_pages(folder, COLORS)
+    build(folder, output)
+    with open(output / 'Output.pdf', 'rb') as f:
+        data = f.read()
+    start = int(re.search(rb'startxref\n(\d+)\n%%EOF\n$', data).group(1))
+    header = re.match(rb'xref\n0 (\d+)\n', data[start:])
+    assert header
+    count = int(header.group(1))
+    table = data[start + header.end():start + header.end() + count * 20]
+    entries = [table[i:i + 20] for i in range(0, len(table), 20)]
+    assert len(entries) == count
+    assert entries[0] == b'0000000000 65535 f \n'
+    for number, entry in enumerate(entries[1:], 1):
+        assert re.fullmatch(rb'\d{10} 00000 n \n', entry)
+        # Each offset points at its own object
+        offset = int(entry[:10])
+        assert data[offset:].startswith(b'%d 0 obj\n' % number)
+    assert data[start + header.end() + count * 20:].startswith(b'trailer\n')
+
+
+@pytest.mark.parametrize('stale', ['size', 'mtime'])
+def test_stale_manifest_is_ignored(tmp_path, stale):
+    folder, output = tmp_path / 'pages', tmp_path / 'out'
+    folder.mkdir()
+    make_pages(folder, COLORS)
+    build(folder, output)
+    pdf_path = str(output / 'Output.pdf')
+    assert os.path.exists(manifest_path(pdf_path))
+    previous = PreviousOutput(pdf_path)
+    assert len(previous.spans) == 4
+    previous.close()
+
+    stat = os.stat(pdf_path)
+    if stale == 'size':
+        with open(pdf_path, 'ab') as f:
+            f.write(b'\n')
+        os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    else:
+        os.utime(pdf_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    previous = PreviousOutput(pdf_path)
+    assert previous.spans == {} and previous.file is None
+
+    # The next build renders every page again
+    report = build(folder, output)
+    assert report.pages == 4 and report.reused == 0
@@ -0,0 +1,41 @@
+import pytest
+from PIL import Image, ImageChops
+
+import kdp_resample
+from kdp_resample import numpy_resample, strip_resample
+
+
+def max_difference(a, b):
+    assert a.mode == b.mode and a.size == b.size
+    extrema = ImageChops.difference(a, b).getextrema()
+    if len(a.getbands()) == 1:
+        extrema = [extrema]
+    return max(high for _, high in extrema)
+
+
+def noise(mode, size):
+    return Image.effect_noise(size, 60).convert(mode)
+
+
+@pytest.mark.parametrize('extension', ['.bmp', '.png'])
+@pytest.mark.parametrize('filter_name', ['LANCZOS', 'BILINEAR'])
+def test_strip_resample_matches_resize(tmp_path, monkeypatch, extension, filter_name):
+    # Small bands, so even this image is cut into many of them
+    monkeypatch.setattr(kdp_resample, 'STRIP_BAND_PIXELS', 40 * 1000)
+    source = noise('RGB', (900, 1300))
+    path = tmp_path / ('page' + extension)
+    source.save(path)
+    size = (410, 590)
+    expected = source.resize(size, getattr(Image, filter_name))
+    with Image.open(path) as image:
+        result = strip_resample(image, size, filter_name)
+    assert max_difference(result, expected) <= 1
+
+
+@pytest.mark.parametrize('mode', ['L', 'RGB', 'CMYK'])
+@pytest.mark.parametrize('size', [(410, 590), (1300, 1700)])
+def test_numpy_resample_matches_resize(mode, size):
+    pytest.importorskip('numpy')
+    source = noise(mode, (900, 1300))
+    expected = source.resize(size, Image.LANCZOS)
+    assert max_difference(numpy_resample(source, size), expected) <= 1